@@ -0,0 +1,91 @@
+"""
+RedisCache'i gerçek Redis olmadan denemek için yerel sahte RESP sunucusu.
+
+Örnek:
+    python fake_redis.py --port 6390 --delay 0.2
+    CACHE_BACKEND=redis REDIS_URL=redis://localhost:6390/0 uvicorn main:app
+
+Sadece RedisCache'in kullandığı komutları bilir (GET, SET ... EX, PTTL, DEL, AUTH, SELECT, PING).
+--delay her cevaptan önce bekler; yavaş sunucu / iptal senaryolarını denemek içindir.
+"""
+import argparse
+import asyncio
+import time
+
+
+class FakeRedis:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.data: dict[bytes, tuple[bytes, float | None]] = {}
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> list[bytes] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, args: list[bytes]) -> bytes:
+        name = args[0].upper()
+        if name in (b"AUTH", b"SELECT", b"PING"):
+            return b"+OK\r\n" if name != b"PING" else b"+PONG\r\n"
+        if name == b"GET":
+            value, expires = self.data.get(args[1], (None, None))
+            if value is None or (expires is not None and expires <= time.time()):
+                self.data.pop(args[1], None)
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET":
+            expires = None
+            if len(args) >= 5 and args[3].upper() == b"EX":
+                expires = time.time() + int(args[4])
+            self.data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if name == b"PTTL":
+            value, expires = self.data.get(args[1], (None, None))
+            if value is None or (expires is not None and expires <= time.time()):
+                return b":-2\r\n"
+            return b":%d\r\n" % (-1 if expires is None else int((expires - time.time()) * 1000))
+        if name == b"DEL":
+            removed = sum(self.data.pop(key, None) is not None for key in args[1:])
+            return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % name.lower()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (args := await self._read_command(reader)) is not None:
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._execute(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Sunucu kapanırken açık bağlantılar iptal edilir
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, delay: float):
+    server = await asyncio.start_server(FakeRedis(delay).handle, host, port)
+    print(f"Sahte Redis {host}:{port} adresinde dinliyor (gecikme {delay} sn).")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RedisCache için yerel sahte RESP sunucusu.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    parser.add_argument("--delay", type=float, default=0.0, help="Her cevaptan önce beklenecek süre (sn)")
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,220 @@
 import os
+import re
+import csv
+import mmap
+import struct
+import gzip
 import json
-from fastapi import FastAPI, HTTPException
+import time
+import sqlite3
+import hashlib
+import hmac
+import asyncio
+import uuid
+import random
+import threading
+import urllib.parse
+import socket
+import ipaddress
+from collections import Counter, OrderedDict, defaultdict, deque
+from itertools import combinations, product
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from contextvars import ContextVar
+from fastapi import FastAPI, HTTPException, Request, Response, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from starlette.datastructures import Headers
 from pydantic import BaseModel
 from google import genai
-from google.genai import types
+from google.genai import types, errors
 from dotenv import load_dotenv
+import httpx
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # brotli kurulu değilse sadece gzip kullanılır
+    brotli = None
+
+try:
+    import h2  # noqa: F401  (httpx'in HTTP/2 desteği için)
+except ImportError:  # h2 kurulu değilse HTTP/1.1 keep-alive ile devam edilir
+    h2 = None
 
 # 1. Ortam değişkenlerini yükle (.env dosyasından)
 load_dotenv()
 
-# 2. API Anahtarını Al
+# 2. API Anahtarlarını Al (GEMINI_API_KEYS ile virgülle ayrılmış birden fazla anahtar verilebilir)
+api_keys = [k.strip() for k in os.environ.get("GEMINI_API_KEYS", "").split(",") if k.strip()]
 api_key = os.environ.get("OPENAI_API_KEY")
+if api_key and api_key not in api_keys:
+    api_keys.append(api_key)
 
-if not api_key:
+if not api_keys:
     raise ValueError("API Anahtarı bulunamadı! Lütfen .env dosyasını kontrol edin.")
 
-# 3. Gemini İstemcisini Başlat
-client = genai.Client(api_key=api_key)
+# 3. Gemini istemcileri aşağıdaki ClientPool içinde anahtar başına bir tane oluşturulur
+GEMINI_KEY_RPM = int(os.environ.get("GEMINI_KEY_RPM", 0))  # Anahtar başına dakikalık kota (0 = sınırsız)
+GEMINI_EJECT_SECONDS = float(os.environ.get("GEMINI_EJECT_SECONDS", 30))
+
+# Gemini HTTP bağlantı havuzu: worker başına tek paylaşılan httpx istemcisi (tüm anahtarlar ve endpointler için)
+GEMINI_HTTP_MAX_CONNECTIONS = int(os.environ.get("GEMINI_HTTP_MAX_CONNECTIONS", 32))
+GEMINI_HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("GEMINI_HTTP_KEEPALIVE_CONNECTIONS", 16))
+GEMINI_HTTP_KEEPALIVE_SECONDS = float(os.environ.get("GEMINI_HTTP_KEEPALIVE_SECONDS", 120))
+GEMINI_HTTP2 = os.environ.get("GEMINI_HTTP2", "1") == "1"
+GEMINI_HTTP_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_HTTP_TIMEOUT_SECONDS", 60))
+GEMINI_HTTP_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_HTTP_CONNECT_TIMEOUT_SECONDS", 5))
+# Trafik yokken bağlantıyı sıcak tutmak için periyodik hafif istek (0 = kapalı)
+GEMINI_KEEPWARM_SECONDS = float(os.environ.get("GEMINI_KEEPWARM_SECONDS", 45))
+
+# Model kademeleri: hafif model basit/önbelleklenebilir işler için, tam model kısıtlı istekler için
+GEMINI_FULL_MODEL = os.environ.get("GEMINI_FULL_MODEL", "gemini-2.0-flash")
+GEMINI_LIGHT_MODEL = os.environ.get("GEMINI_LIGHT_MODEL", "gemini-2.0-flash-lite")
+UPSTREAM_TIMEOUT_SECONDS = float(os.environ.get("UPSTREAM_TIMEOUT_SECONDS", 30))
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 0.5))
+
+# Öncelikli zamanlayıcı: eşzamanlı Gemini çağrısı sınırı, interactive'e ayrılan kısım ve kuyruk ağırlıkları
+UPSTREAM_CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", 16))
+UPSTREAM_RESERVED_INTERACTIVE = int(os.environ.get("UPSTREAM_RESERVED_INTERACTIVE", 4))
+SCHEDULER_WEIGHTS = os.environ.get("SCHEDULER_WEIGHTS", "interactive:6,batch:3,background:1")
+# Makine genelindeki (tüm worker'lar + pregenerate.py) eşzamanlı çağrı sınırı; yol boşsa sadece process içi sınır
+UPSTREAM_SHARED_PATH = os.environ.get("UPSTREAM_SHARED_PATH", "upstream.sqlite3")
+UPSTREAM_SHARED_CAPACITY = int(os.environ.get("UPSTREAM_SHARED_CAPACITY", UPSTREAM_CONCURRENCY))
+UPSTREAM_SHARED_POLL_SECONDS = float(os.environ.get("UPSTREAM_SHARED_POLL_SECONDS", 0.25))
+
+# Token muhasebesi: günlük bütçe (0 = sınırsız), istemciye özel bütçeler "mobil:200000,web:500000"
+USAGE_PATH = os.environ.get("USAGE_PATH", "usage.sqlite3")
+TOKEN_DAILY_BUDGET = int(os.environ.get("TOKEN_DAILY_BUDGET", 0))
+TOKEN_CLIENT_BUDGETS = os.environ.get("TOKEN_CLIENT_BUDGETS", "")
+TOKEN_FLUSH_SECONDS = float(os.environ.get("TOKEN_FLUSH_SECONDS", 30))
+# Yönetici uçları (/api/admin/*) için X-Admin-Token; ayarlanmazsa bu uçlar kapalıdır
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    token_ledger.start()
+    await job_runner.start()
+    snapshot_task = None
+    if CACHE_SNAPSHOT_PATH:
+        recipe_cache.attach_snapshot(CACHE_SNAPSHOT_PATH)
+        snapshot_task = asyncio.create_task(cache_snapshot_loop())
+    keepwarm_task = asyncio.create_task(upstream_http.keep_warm_loop()) if GEMINI_KEEPWARM_SECONDS > 0 else None
+    purge_task = asyncio.create_task(cache_purge_loop()) if CACHE_PURGE_SECONDS > 0 else None
+    yield
+    if purge_task is not None:
+        purge_task.cancel()
+    if keepwarm_task is not None:
+        keepwarm_task.cancel()
+    await job_runner.stop()
+    await token_ledger.stop()
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        await save_cache_snapshot()
+    # Kapanırken önbellekte bekleyen yazmaları tamamla, bağlantıları kapat
+    await recipe_cache.close()
+    await upstream_http.close()
+
+app = FastAPI(lifespan=lifespan)
+
+class RequestContextMiddleware:
+    """
+    Her istekte istemci kimliğini (X-Client-Id) ve süre sınırını context'e yazar.
+    Saf ASGI olarak yazıldı; receive'i sarmadığı için request.is_disconnected() çalışır.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            # Token muhasebesi ve bütçeler istemci kimliğine göre tutulur
+            current_client_id.set(headers.get("x-client-id", "anonim"))
+            try:
+                current_deadline.set(parse_deadline(headers))
+            except HTTPException as e:
+                response = JSONResponse(status_code=e.status_code, content={"detail": e.detail})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestContextMiddleware)
+
+# Önbellek ayarları
+# CACHE_BACKEND: memory | sqlite | redis | tiered (L1 bellek + L2 paylaşımlı)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "sqlite")
+CACHE_L2_BACKEND = os.environ.get("CACHE_L2_BACKEND", "sqlite")
+CACHE_PATH = os.environ.get("CACHE_PATH", "cache.sqlite3")
+RECIPE_STORE_PATH = os.environ.get("RECIPE_STORE_PATH", "recipes.sqlite3")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Süresi dolmuş SQLite önbellek satırlarının silinme aralığı (0 = kapalı)
+CACHE_PURGE_SECONDS = float(os.environ.get("CACHE_PURGE_SECONDS", 3600))
+# Bellek önbelleğinin disk görüntüsü (boş bırakılırsa kapalı)
+CACHE_SNAPSHOT_PATH = os.environ.get("CACHE_SNAPSHOT_PATH", "cache.snapshot")
+CACHE_SNAPSHOT_SECONDS = float(os.environ.get("CACHE_SNAPSHOT_SECONDS", 300))
+CACHE_SNAPSHOT_MAX_ENTRIES = int(os.environ.get("CACHE_SNAPSHOT_MAX_ENTRIES", 10000))
+
+# Arka plan işleri (202 + sorgulama)
+JOBS_PATH = os.environ.get("JOBS_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", 300))
+JOB_MAX_WAIT_SECONDS = float(os.environ.get("JOB_MAX_WAIT_SECONDS", 30))
+# Özel/iç ağda olsa da webhook gönderilebilecek hostlar (virgülle ayrılmış)
+JOB_CALLBACK_HOSTS = {h.strip().lower() for h in os.environ.get("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()}
 
-app = FastAPI()
+# WebSocket düzenleme oturumları
+WS_MAX_SESSIONS = int(os.environ.get("WS_MAX_SESSIONS", 500))
+WS_SESSION_IDLE_SECONDS = float(os.environ.get("WS_SESSION_IDLE_SECONDS", 900))
+WS_MAX_TURNS = int(os.environ.get("WS_MAX_TURNS", 8))
+MEMORY_CACHE_MAX_ENTRIES = int(os.environ.get("MEMORY_CACHE_MAX_ENTRIES", 1024))
+# CACHE_ADMISSION: tinylfu | none (bellek önbelleğine kabul politikası)
+CACHE_ADMISSION = os.environ.get("CACHE_ADMISSION", "tinylfu")
+POPULARITY_SKETCH_WIDTH = int(os.environ.get("POPULARITY_SKETCH_WIDTH", 8192))
+POPULARITY_TOP_K = int(os.environ.get("POPULARITY_TOP_K", 50))
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 7 * 24 * 3600))
+MENU_CACHE_TTL_SECONDS = int(os.environ.get("MENU_CACHE_TTL_SECONDS", 6 * 3600))
+
+# Menü motoru: havuz bu sayının altına inince arka planda Gemini ile doldurulur
+MENU_COURSE_POOL_MIN = int(os.environ.get("MENU_COURSE_POOL_MIN", 12))
+MENU_TOPUP_BATCH = int(os.environ.get("MENU_TOPUP_BATCH", 4))
+MENU_CANDIDATES = int(os.environ.get("MENU_CANDIDATES", 8))
+MENU_NO_REPEAT_DAYS = float(os.environ.get("MENU_NO_REPEAT_DAYS", 7))
+MENU_TARGET_KALORI = int(os.environ.get("MENU_TARGET_KALORI", 1100))
+
+# Spekülatif ön yükleme (varsayılan kapalı): malzemeden tarif sonrası isimden tarif + diyet varyantları
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "0") == "1"
+PREFETCH_DIET_VARIANTS = [v.strip() for v in os.environ.get("PREFETCH_DIET_VARIANTS", "Vegan,Glutensiz").split(",") if v.strip()]
+PREFETCH_MAX_PENDING = int(os.environ.get("PREFETCH_MAX_PENDING", 8))
+PREFETCH_MAX_TRACKED = int(os.environ.get("PREFETCH_MAX_TRACKED", 5000))
+
+# Çıktı token sınırları: kısmi alan (compact) modu, tam tarif ve menü için
+MAX_OUTPUT_TOKENS_COMPACT = int(os.environ.get("MAX_OUTPUT_TOKENS_COMPACT", 512))
+MAX_OUTPUT_TOKENS_FULL = int(os.environ.get("MAX_OUTPUT_TOKENS_FULL", 2048))
+MAX_OUTPUT_TOKENS_MENU = int(os.environ.get("MAX_OUTPUT_TOKENS_MENU", 4096))
+REPAIR_MAX_ATTEMPTS = int(os.environ.get("REPAIR_MAX_ATTEMPTS", 2))
+
+# Negatif önbellek: reddedilen girdiler kısa süre hatırlanır
+NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get("NEGATIVE_CACHE_TTL_SECONDS", 900))
+NEGATIVE_PARSE_FAILURES = int(os.environ.get("NEGATIVE_PARSE_FAILURES", 2))
+
+# Besin değeri motoru: kalori modelden istenmez, malzemelerden hesaplanır
+# NUTRITION_MODE: replace (her zaman hesapla) | fill (sadece eksikse hesapla)
+NUTRITION_TABLE_PATH = os.environ.get(
+    "NUTRITION_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "nutrition.csv")
+)
+NUTRITION_MODE = os.environ.get("NUTRITION_MODE", "replace")
+NUTRITION_DEFAULT_SERVINGS = int(os.environ.get("NUTRITION_DEFAULT_SERVINGS", 4))
+# Malzeme satırlarının en az bu kadarı tabloda eşleşmezse kalori hesaplanmaz ("Bilinmiyor")
+NUTRITION_MIN_MATCHED = float(os.environ.get("NUTRITION_MIN_MATCHED", 0.75))
+
+# CDN / HTTP önbellek başlıkları (GET endpointleri için)
+CDN_MAX_AGE = int(os.environ.get("CDN_MAX_AGE", 3600))
+CDN_S_MAXAGE = int(os.environ.get("CDN_S_MAXAGE", 24 * 3600))
+CDN_STALE_WHILE_REVALIDATE = int(os.environ.get("CDN_STALE_WHILE_REVALIDATE", 7 * 24 * 3600))
+
+# Cevap sıkıştırma ayarları
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+ENCODED_CACHE_MAX_ENTRIES = int(os.environ.get("ENCODED_CACHE_MAX_ENTRIES", 512))
 
 # ---------------------------------------------------------
 # VERİ MODELLERİ (Pydantic) - GÜNCELLENDİ ✅
@@ -28,10 +224,16 @@ class IngredientRequest(BaseModel):
     ingredients: list[str]
     kategori: str
     diet_info: str = "" # YENİ: Diyet bilgisi (Boş olabilir)
+    fields: list[str] | None = None # Sadece bu alanlar üretilir (örn: ["yemekAdi", "sure"])
 
 class DishRequest(BaseModel):
     dish_name: str
     diet_info: str = "" # YENİ: Diyet bilgisi (Boş olabilir)
+    fields: list[str] | None = None # Sadece bu alanlar üretilir (örn: ["yemekAdi", "sure"])
+
+class NutritionRequest(BaseModel):
+    malzemeler: list[str]
+    porsiyon: int | None = None # Verilmezse NUTRITION_DEFAULT_SERVINGS
 
 # ---------------------------------------------------------
 # YARDIMCI FONKSİYONLAR
@@ -53,157 +255,3739 @@ def clean_json_response(text: str):
         
     return cleaned_text.strip()
 
+def normalize_text(value: str) -> str:
+    """Türkçe büyük/küçük harf kurallarıyla küçültür ve fazla boşlukları atar."""
+    value = value.replace("İ", "i").replace("I", "ı")
+    return " ".join(value.lower().split())
+
+def make_cache_key(endpoint: str, **params) -> str:
+    """
+    İsteği normalize edip (küçük harf, boşluklar, sıralı malzemeler)
+    önbellek anahtarı üretir. Aynı yemek için farklı yazımlar aynı anahtara düşer.
+    """
+    normalized = {}
+    for name, value in params.items():
+        if name == "diet_info":
+            # Aynı kısıtlamanın farklı yazımları aynı anahtara düşsün
+            value = parse_diet(value).cache_key()
+        elif isinstance(value, str):
+            value = normalize_text(value)
+        elif isinstance(value, list):
+            value = sorted(normalize_text(str(v)) for v in value)
+        normalized[name] = value
+    payload = json.dumps([endpoint, normalized], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 # ---------------------------------------------------------
-# API ENDPOINTLERİ
+# DİYET KISITLAMALARI (Serbest metin -> sabit bayraklar)
 # ---------------------------------------------------------
 
-# 1. ŞEFİN TAVSİYESİ (MENÜ)
-@app.post("/api/chef-recommendation")
-async def get_chef_recommendation():
-    menu_prompt = (
-        "Şu anki mevsime uygun, Türk mutfağından popüler ve birbirini tamamlayan "
-        "3 aşamalı bir akşam yemeği menüsü oluştur: 1) Çorba, 2) Ana Yemek, 3) Tatlı. "
-        
-        "Cevabı SADECE aşağıdaki JSON formatında döndür. Başka hiçbir metin ekleme."
-        "JSON Şeması:"
-        "{"
-        "  'menu': ["
-        "    { "
-        "      'yemekAdi': '...', "
-        "      'aciklama': '...', "
-        "      'sure': '...', "
-        "      'kalori': '...', "
-        "      'malzemeler': ['...'], "
-        "      'tarif': ['...'],"
-        "      'image_prompt': '[Yemeğin Adı] sunumu yemek fotoğrafı'"
-        "    },"
-        "    { "
-        "      'yemekAdi': '...', "
-        "      'aciklama': '...', "
-        "      'sure': '...', "
-        "      'kalori': '...', "
-        "      'malzemeler': ['...'], "
-        "      'tarif': ['...'],"
-        "      'image_prompt': '[Yemeğin Adı] sunumu yemek fotoğrafı'"
-        "    },"
-        "    { "
-        "      'yemekAdi': '...', "
-        "      'aciklama': '...', "
-        "      'sure': '...', "
-        "      'kalori': '...', "
-        "      'malzemeler': ['...'], "
-        "      'tarif': ['...'],"
-        "      'image_prompt': '[Yemeğin Adı] sunumu yemek fotoğrafı'"
-        "    }"
-        "  ]"
-        "}"
+# ad -> (eşleşen ifadeler, prompt'a yazılacak kural, ima ettiği diğer bayraklar)
+# Sıra değişmemeli: bit değerleri buradaki sıradan gelir ve önbellek anahtarlarına girer.
+DIET_FLAGS = {
+    "vegan": (
+        (r"vegan\w*", r"hayvansal (?:ürün|gıda|besin)\w* (?:yok|yemiyorum|içermesin|olmasın|kullanma\w*)", r"bitkisel beslen\w*"),
+        "Vegan: et, balık, süt ürünleri, yumurta ve bal kullanma",
+        ("vejetaryen", "laktozsuz", "yumurtasiz"),
+    ),
+    "vejetaryen": (
+        (r"vejetaryen\w*", r"vejeteryan\w*", r"etsiz", r"et (?:yemiyorum|yok|olmasın|içermesin)"),
+        "Vejetaryen: et, tavuk ve balık kullanma",
+        (),
+    ),
+    "glutensiz": (
+        (r"glutensiz", r"gluten\w* (?:yok|olmasın|içermesin|hassasiyet\w*|intolerans\w*|alerji\w*)", r"çölyak\w*"),
+        "Glutensiz: buğday unu, arpa, çavdar, bulgur ve irmik kullanma",
+        (),
+    ),
+    "laktozsuz": (
+        (r"laktozsuz", r"laktoz\w* (?:yok|olmasın|içermesin|hassasiyet\w*|intolerans\w*)", r"sütsüz",
+         r"süt ürün\w* (?:yok|olmasın|içermesin|yemiyorum)"),
+        "Laktozsuz: süt ve süt ürünleri kullanma",
+        (),
+    ),
+    "sekersiz": (
+        (r"şekersiz", r"şeker (?:yok|olmasın|içermesin)", r"diyabet\w*", r"şeker hasta\w*"),
+        "Şekersiz: rafine şeker ve şurup kullanma",
+        (),
+    ),
+    "dusuk_karbonhidrat": (
+        (r"keto\w*", r"düşük karbonhidrat\w*", r"low carb"),
+        "Düşük karbonhidrat: un, pirinç, makarna, patates ve şekeri en aza indir",
+        (),
+    ),
+    "yumurtasiz": (
+        (r"yumurtasız", r"yumurta (?:alerji\w*|yok|olmasın|içermesin|yemiyorum)"),
+        "Yumurtasız: yumurta kullanma",
+        (),
+    ),
+    "kuruyemissiz": (
+        (r"kuruyemişsiz", r"fıstıksız", r"fındıksız", r"(?:fıstık|fındık|ceviz|badem|kuruyemiş) alerji\w*"),
+        "Kuruyemişsiz: fıstık, fındık, ceviz, badem ve benzerlerini kullanma",
+        (),
+    ),
+    "az_tuzlu": (
+        (r"tuzsuz", r"az tuz\w*", r"düşük sodyum\w*", r"hipertansiyon\w*", r"tansiyon\w*"),
+        "Az tuzlu: tuzu en aza indir",
+        (),
+    ),
+}
+DIET_BITS = {name: 1 << i for i, name in enumerate(DIET_FLAGS)}
+# Bayrak adının kendisi de (örn. ?diet=sekersiz) eşleşir
+_DIET_PATTERNS = {
+    name: re.compile(r"(?<!\w)(?:" + "|".join((re.escape(name), *patterns)) + r")(?!\w)")
+    for name, (patterns, _, _) in DIET_FLAGS.items()
+}
+# Bayraklara eşlenmeyen metinden atılan dolgu kelimeleri
+DIET_STOPWORDS = {
+    "beslenme", "beslenmesi", "beslenmeye", "besleniyorum", "diyet", "diyeti", "diyetine", "diyetindeyim",
+    "ve", "ile", "veya", "uygun", "için", "lütfen", "bir", "tarif", "tarifi",
+    "istiyorum", "yapıyorum", "alerjim", "alerjisi", "hassasiyetim", "kısıtlama", "kısıtlamam",
+    "kısıtlamalar", "de", "da", "ben", "benim", "hastasıyım", "hastalığım", "hastalığı",
+}
+# Bayrağa aykırı malzemeler (türetilmiş tariflerin kontrolü için). az_tuzlu gibi miktar
+# kısıtlamaları malzeme adından anlaşılamaz, listede yoktur.
+_MEAT = r"et|kıyma|kuşbaşı|tavuk|tavuğ|hindi|piliç|balık|hamsi|somon|levrek|çipura|ton balığı|karides|sucuk|pastırma|sosis|salam|et suyu|tavuk suyu|kemik suyu"
+_DAIRY = r"süt|yoğurt|yoğurd|peynir|kaşar|lor|labne|tereyağ|krema|kaymak|ayran|parmesan|mozzarella"
+# Malzeme adından sonra sadece iyelik/çoğul ekine izin verilir: "sütü", "suyu" eşleşir,
+# "etli domates", "sütlü kahve" ve "balkabağı" eşleşmez
+INGREDIENT_SUFFIX = r"(?:ı|i|u|ü|sı|si|su|sü|yı|yi|yu|yü|lar|ler|ları|leri)?(?!\w)"
+DIET_CONFLICTS = {
+    name: re.compile(r"(?<!\w)(?:" + pattern + r")" + INGREDIENT_SUFFIX)
+    for name, pattern in {
+        "vegan": _MEAT + "|" + _DAIRY + r"|yumurta|bal",
+        "vejetaryen": _MEAT,
+        "glutensiz": r"un|buğday|bulgur|irmik|makarna|şehriye|erişte|ekmek|ekmeğ|galeta|yufka|milföy|lavaş|arpa|çavdar",
+        "laktozsuz": _DAIRY,
+        "sekersiz": r"şeker|pudra şekeri|pekmez|şurup|bal",
+        "dusuk_karbonhidrat": r"un|pirinç|makarna|şehriye|erişte|bulgur|patates|ekmek|ekmeğ|şeker",
+        "yumurtasiz": r"yumurta",
+        "kuruyemissiz": r"fıstık|fıstığ|fındık|fındığ|ceviz|badem|kaju|kuruyemiş",
+    }.items()
+}
+# "bitkisel süt", "glutensiz un" gibi ikame satırları aykırı sayılmaz
+DIET_SUBSTITUTE_RE = re.compile(
+    r"(?<!\w)(?:bitkisel|vegan|glutensiz|laktozsuz|şekersiz|yumurtasız|soya|yulaf sütü|badem sütü|hindistan cevizi|"
+    r"pirinç unu|mısır unu|nohut unu|karabuğday|tatlandırıcı|stevia)"
+)
+
+# Olumsuzluk/miktar kelimeleri anlamı tersine çevirir ("soğan olsun" / "soğan olmasın"),
+# bu yüzden serbest metinde kalır; yalnız başlarına kalırlarsa (örn. "fıstık alerjim var") atılır.
+# Bayrak ifadesinden hemen sonra gelince onu olumsuzlayan kelimeler
+DIET_NEGATION_RE = re.compile(r"\s*(?:değil\w*|olmasın|olmayan|olmamalı|istemiyorum|hariç)(?!\w)")
+DIET_POLARITY_WORDS = {"yok", "var", "olsun", "olmalı", "olmasın", "olmadan", "az", "çok", "ama", "değil"}
+
+
+class DietConstraints:
+    """Ayrıştırılmış diyet: bayrak bitleri + bayraklara eşlenmeyen serbest metin."""
+
+    __slots__ = ("bits", "extra", "rest")
+
+    def __init__(self, bits: int, extra: str, rest: str):
+        self.bits = bits
+        self.extra = extra
+        # Diyet ifadeleri çıkarılmış metin ("Vegan Lahmacun" -> "lahmacun")
+        self.rest = rest
+
+    def __bool__(self) -> bool:
+        return bool(self.bits or self.extra)
+
+    def flags(self) -> list[str]:
+        return [name for name, bit in DIET_BITS.items() if self.bits & bit]
+
+    def cache_key(self) -> str:
+        """Önbellek anahtarına giren kanonik biçim; kısıtlama yoksa boş (eski anahtarlarla aynı)."""
+        if not self:
+            return ""
+        return f"{self.bits:x}|{self.extra}" if self.extra else f"{self.bits:x}"
+
+    def canonical(self) -> str:
+        """Tekrar ayrıştırıldığında aynı kısıtlamayı veren kanonik metin (CDN URL'leri için)."""
+        return " ".join([*self.flags(), self.extra] if self.extra else self.flags())
+
+    def violations(self, malzemeler: list[str]) -> list[str]:
+        """Bu kısıtlamaya aykırı görünen malzeme satırları."""
+        patterns = [DIET_CONFLICTS[name] for name in self.flags() if name in DIET_CONFLICTS]
+        found = []
+        for line in malzemeler:
+            text = normalize_text(str(line))
+            if DIET_SUBSTITUTE_RE.search(text):
+                continue
+            if any(pattern.search(text) for pattern in patterns):
+                found.append(line)
+        return found
+
+    def prompt_text(self) -> str:
+        rules = [DIET_FLAGS[name][1] for name in self.flags()]
+        if self.extra:
+            # Dolgu kelimeleri atılmış anahtar yerine kullanıcının asıl metni gider
+            rules.append(f"Ek not: {self.rest.strip(' ,.;')}")
+        return "; ".join(rules)
+
+
+@lru_cache(maxsize=4096)
+def parse_diet(diet_info: str) -> DietConstraints:
+    """'vegan', 'Vegan.', 'vegan beslenme' ve 'hayvansal ürün yok' aynı bayrağa düşer."""
+    text = normalize_text(diet_info or "")
+    bits = 0
+
+    def take(match: re.Match) -> str:
+        nonlocal bits
+        # "vegan değil", "vejetaryen değilim": bayrak konmaz, ifade serbest metinde kalır (anahtar da farklı olur)
+        if DIET_NEGATION_RE.match(match.string, match.end()):
+            return match.group(0)
+        bits |= DIET_BITS[name]
+        return " "
+
+    for name, pattern in _DIET_PATTERNS.items():
+        text = pattern.sub(take, text)
+    for name in list(DIET_FLAGS):
+        if bits & DIET_BITS[name]:
+            for implied in DIET_FLAGS[name][2]:
+                bits |= DIET_BITS[implied]
+    rest = " ".join(text.split())
+    words = [w for w in re.split(r"[^\w]+", rest) if w and w not in DIET_STOPWORDS]
+    if all(w in DIET_POLARITY_WORDS for w in words):
+        words = []
+    return DietConstraints(bits, " ".join(words), rest)
+
+
+def diet_prompt(diet_info: str) -> str:
+    """Prompt'a giden kısıtlama metni: serbest metin yerine sabit şablonlar."""
+    return parse_diet(diet_info).prompt_text() or "Yok"
+
+
+# ---------------------------------------------------------
+# ÖNBELLEK KATMANLARI (Bellek / SQLite / Redis / İki Kademeli)
+# ---------------------------------------------------------
+
+class CacheBackend:
+    """
+    Tüm önbellek katmanlarının ortak (async) arayüzü.
+    Endpointler sadece get_or_load() kullanır; arkadaki katman ayardan seçilir.
+    """
+
+    default_ttl: int = CACHE_TTL_SECONDS
+
+    def __init__(self):
+        # Worker içinde devam eden üretimler (anahtar -> task) ve her birini bekleyen istek sayısı
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._waiters: dict[str, int] = {}
+
+    async def get(self, key: str):
+        raise NotImplementedError
+
+    async def get_with_ttl(self, key: str) -> tuple[object, float | None]:
+        """(değer, kalan süre sn) döner; kalan süreyi bilmeyen katmanlarda süre None'dır."""
+        return await self.get(key), None
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def attach_snapshot(self, path: str):
+        """Diskteki görüntüden sıcak başlangıç. Kalıcı katmanlarda (SQLite/Redis) gerekmez."""
+        pass
+
+    async def save_snapshot(self, path: str, max_entries: int):
+        pass
+
+    async def purge_expired(self) -> int:
+        """Süresi dolmuş kayıtları siler. Bellek (LRU) ve Redis (EX) kendi temizlediği için varsayılan boş."""
+        return 0
+
+    async def get_or_load(self, key: str, loader, ttl: int | None = None, fields=None, merge=None):
+        """
+        Read-through: önbellekte yoksa loader() ile üretip yazar.
+        Aynı worker içinde aynı anahtar için tek bir üretim çalışır,
+        diğer istekler onun sonucunu bekler.
+
+        fields verilirse kayıt sadece bu alanların hepsini içeriyorsa isabet sayılır;
+        eksikse loader() eksik alanları üretir ve merge(eski, yeni) ile birleştirilip yazılır.
+        """
+        try:
+            cached = await self.get(key)
+        except Exception as e:
+            print(f"HATA (Önbellek okuma): {e}")
+            cached = None
+        if cached is not None and (fields is None or fields <= cached.keys()):
+            return cached
+
+        inflight_key = key if fields is None else key + "|" + ",".join(sorted(fields))
+        task = self._inflight.get(inflight_key)
+        if task is None:
+            task = asyncio.ensure_future(self._shared_load(loader))
+            self._inflight[inflight_key] = task
+            self._waiters[inflight_key] = 0
+            task.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        self._waiters[inflight_key] += 1
+        try:
+            value = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Bekleyen son istek de vazgeçtiyse üretimi durdur
+            if self._waiters[inflight_key] == 1 and not task.done():
+                task.cancel()
+            raise
+        finally:
+            self._waiters[inflight_key] -= 1
+            if not self._waiters[inflight_key]:
+                self._waiters.pop(inflight_key, None)
+        if fields is not None:
+            # Üretim sürerken aynı anahtara başka alan kümesiyle yazılmış olabilir:
+            # birleştirme en güncel kayıtla yapılır, daha kapsamlı kayıt kısmi sonuçla ezilmez
+            try:
+                latest = await self.get(key)
+            except Exception as e:
+                print(f"HATA (Önbellek okuma): {e}")
+                latest = cached
+            if latest is not None and merge is not None:
+                value = merge(latest, value)
+            if latest is not None and not latest.keys() <= value.keys():
+                return value
+
+        try:
+            await self.set(key, value, ttl)
+        except Exception as e:
+            print(f"HATA (Önbellek yazma): {e}")
+        return value
+
+    @staticmethod
+    async def _shared_load(loader):
+        """
+        Ortak üretim ilk isteğin context'ini kopyalar; o isteğin süre sınırı
+        diğer bekleyenleri de düşürmesin diye burada kaldırılır. Her istek kendi
+        süresini run_while_connected içinde uygular, son bekleyen vazgeçince üretim iptal olur.
+        """
+        current_deadline.set(None)
+        return await loader()
+
+
+# Önbellek görüntüsü dosya düzeni:
+#   başlık | kayıt verileri (anahtar + JSON değer) | sha256'ya göre sıralı indeks
+SNAPSHOT_MAGIC = b"BYSNAP01"
+SNAPSHOT_HEADER = struct.Struct("<8sIQ")      # magic, kayıt sayısı, indeks başlangıcı
+SNAPSHOT_RECORD = struct.Struct("<32sdQII")   # sha256(anahtar), expires_at, offset, anahtar boyu, değer boyu
+
+
+class CacheSnapshot:
+    """
+    Diskteki önbellek görüntüsü. Dosya mmap ile açılır, açılışta sadece başlık okunur;
+    kayıtlar istendikçe indekste ikili arama ile bulunup çözülür.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._mm: mmap.mmap | None = None
+        self._index_offset = 0
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            # Dosya yok ya da boş: soğuk başlangıç
+            return
+        magic, count, index_offset = SNAPSHOT_HEADER.unpack_from(mm, 0) if len(mm) >= SNAPSHOT_HEADER.size else (b"", 0, 0)
+        if magic != SNAPSHOT_MAGIC or index_offset + count * SNAPSHOT_RECORD.size > len(mm):
+            print(f"UYARI: Önbellek görüntüsü okunamadı, yok sayılıyor: {path}")
+            mm.close()
+            return
+        self._mm = mm
+        self.count = count
+        self._index_offset = index_offset
+
+    def _record(self, i: int) -> tuple:
+        return SNAPSHOT_RECORD.unpack_from(self._mm, self._index_offset + i * SNAPSHOT_RECORD.size)
+
+    def _find(self, key: str) -> tuple | None:
+        if self._mm is None:
+            return None
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == self.count:
+            return None
+        record = self._record(lo)
+        return record if record[0] == digest else None
+
+    def __contains__(self, key: str) -> bool:
+        return self._find(key) is not None
+
+    def get(self, key: str) -> tuple[float, object] | None:
+        record = self._find(key)
+        if record is None:
+            return None
+        _, expires_at, offset, key_len, value_len = record
+        if expires_at <= time.time():
+            return None
+        start = offset + key_len
+        return expires_at, json.loads(self._mm[start:start + value_len])
+
+    def records(self):
+        """Tüm kayıtları (anahtar, expires_at, ham JSON) olarak döner; yeniden yazarken çözülmez."""
+        for i in range(self.count):
+            _, expires_at, offset, key_len, value_len = self._record(i)
+            key = self._mm[offset:offset + key_len].decode("utf-8")
+            yield key, expires_at, self._mm[offset + key_len:offset + key_len + value_len]
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+def write_cache_snapshot(path: str, records: dict[str, tuple[float, bytes]]):
+    """Kayıtları görüntü dosyasına yazar. Önce geçici dosyaya yazılır, sonra atomik olarak değiştirilir."""
+    entries = sorted(
+        (hashlib.sha256(key.encode("utf-8")).digest(), key.encode("utf-8"), expires_at, raw)
+        for key, (expires_at, raw) in records.items()
     )
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * SNAPSHOT_HEADER.size)
+        index = []
+        offset = SNAPSHOT_HEADER.size
+        for digest, key, expires_at, raw in entries:
+            f.write(key)
+            f.write(raw)
+            index.append(SNAPSHOT_RECORD.pack(digest, expires_at, offset, len(key), len(raw)))
+            offset += len(key) + len(raw)
+        f.write(b"".join(index))
+        f.seek(0)
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(entries), offset))
+    os.replace(tmp_path, path)
 
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=menu_prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
+
+class FrequencySketch:
+    """
+    Count-min sketch ile yaklaşık erişim sıklığı (TinyLFU).
+    Sayaçlar 15'te doyar; toplam artış sample_size'a ulaşınca hepsi yarıya
+    indirilir (yaşlandırma), böylece eskiden popüler olan anahtarlar zamanla unutulur.
+    top_k verilirse en sık görülen anahtarlar etiketleriyle birlikte izlenir.
+    """
+
+    DEPTH = 4
+    MAX_COUNT = 15
+
+    def __init__(self, width: int, top_k: int = 0):
+        self.width = 1 << max(4, (width - 1).bit_length())
+        self._mask = self.width - 1
+        self._rows = [bytearray(self.width) for _ in range(self.DEPTH)]
+        self.sample_size = 10 * self.width
+        self._additions = 0
+        self.resets = 0
+        self.top_k = top_k
+        # anahtar -> [tahmini sıklık, etiket]; top_k'nın birkaç katı aday tutulur
+        self._hot: dict[str, list] = {}
+
+    def _indexes(self, key: str):
+        h = hash(key)
+        step = (h >> 32) | 1
+        return [(h + i * step) & self._mask for i in range(self.DEPTH)]
+
+    def estimate(self, key: str) -> int:
+        return min(row[i] for row, i in zip(self._rows, self._indexes(key)))
+
+    def increment(self, key: str, label=None) -> int:
+        indexes = self._indexes(key)
+        current = min(row[i] for row, i in zip(self._rows, indexes))
+        if current < self.MAX_COUNT:
+            # Conservative update: sadece en küçük sayaçlar artırılır
+            for row, i in zip(self._rows, indexes):
+                if row[i] == current:
+                    row[i] += 1
+            current += 1
+        self._additions += 1
+        if self.top_k:
+            self._track(key, current, label)
+        if self._additions >= self.sample_size:
+            self._age()
+        return current
+
+    def _track(self, key: str, count: int, label):
+        entry = self._hot.get(key)
+        if entry is not None:
+            entry[0] = count
+            return
+        self._hot[key] = [count, label]
+        if len(self._hot) > self.top_k * 4:
+            coldest = min(self._hot, key=lambda k: self._hot[k][0])
+            del self._hot[coldest]
+
+    def _age(self):
+        for row in self._rows:
+            row[:] = bytes(c >> 1 for c in row)
+        for entry in self._hot.values():
+            entry[0] >>= 1
+        self._additions //= 2
+        self.resets += 1
+
+    def top(self, limit: int | None = None) -> list[dict]:
+        ranked = sorted(self._hot.values(), key=lambda entry: entry[0], reverse=True)
+        return [{**label, "score": count} for count, label in ranked[:limit] if count]
+
+
+class MemoryCache(CacheBackend):
+    """
+    Process içi LRU önbellek. En az kullanılan kayıt önce atılır.
+    Bir görüntü bağlıysa, bellekte olmayan anahtarlar görüntüden tembel olarak yüklenir.
+    admission verilirse (TinyLFU) önbellek doluyken yeni anahtar, atılacak kayıttan
+    daha sık isteniyorsa kabul edilir; tek seferlik istekler popüler kayıtları atamaz.
+    """
+
+    def __init__(self, max_entries: int, default_ttl: int, admission: FrequencySketch | None = None):
+        super().__init__()
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.admission = admission
+        self._entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self._snapshot: CacheSnapshot | None = None
+        # Görüntüdeki hali artık geçersiz olan (yazılmış, silinmiş ya da yüklenmiş) anahtarlar.
+        # Sadece görüntüde gerçekten bulunan anahtarlar eklenir; boyutu görüntüyle sınırlı kalır.
+        self._snapshot_skip: set[str] = set()
+
+    async def get(self, key: str):
+        if self.admission is not None:
+            self.admission.increment(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._from_snapshot(key)
+            if entry is None:
+                return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _from_snapshot(self, key: str) -> tuple[float, object] | None:
+        if self._snapshot is None or key in self._snapshot_skip:
+            return None
+        entry = self._snapshot.get(key)
+        if entry is not None:
+            self._snapshot_skip.add(key)
+            self._entries[key] = entry
+            self._evict()
+        return entry
+
+    def _shadow_snapshot(self, key: str):
+        """Görüntüdeki kaydın yerine yenisi yazıldı/silindi: görüntüden tekrar yüklenmesin."""
+        if self._snapshot is not None and key not in self._snapshot_skip and key in self._snapshot:
+            self._snapshot_skip.add(key)
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        if not self._admit(key):
+            return
+        self._shadow_snapshot(key)
+        self._entries[key] = (time.time() + (ttl or self.default_ttl), value)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def _admit(self, key: str) -> bool:
+        if self.admission is None or key in self._entries or len(self._entries) < self.max_entries:
+            return True
+        victim = next(iter(self._entries))
+        if self._entries[victim][0] <= time.time() or self.admission.estimate(key) > self.admission.estimate(victim):
+            cache_admission_stats["admitted"] += 1
+            return True
+        cache_admission_stats["rejected"] += 1
+        return False
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self._shadow_snapshot(key)
+        self._entries.pop(key, None)
+
+    def attach_snapshot(self, path: str):
+        self._snapshot = CacheSnapshot(path)
+        if self._snapshot.count:
+            print(f"Önbellek görüntüsü bağlandı: {path} ({self._snapshot.count} kayıt)")
+
+    async def save_snapshot(self, path: str, max_entries: int):
+        """
+        Canlı kayıtları (en yeni önce) ve görüntüde olup henüz dokunulmamış kayıtları
+        yeni görüntüye yazar. Serileştirme event loop'ta, disk yazımı thread'de yapılır.
+        """
+        now = time.time()
+        records: dict[str, tuple[float, bytes]] = {}
+        for key, (expires_at, value) in reversed(self._entries.items()):
+            if len(records) >= max_entries:
+                break
+            if expires_at > now:
+                records[key] = (expires_at, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        await asyncio.to_thread(self._write_snapshot, path, records, set(self._snapshot_skip), max_entries)
+
+    def _write_snapshot(self, path: str, records: dict, skip, max_entries: int):
+        if self._snapshot is not None:
+            now = time.time()
+            for key, expires_at, raw in self._snapshot.records():
+                if len(records) >= max_entries:
+                    break
+                if key not in skip and key not in records and expires_at > now:
+                    records[key] = (expires_at, raw)
+        write_cache_snapshot(path, records)
+
+    async def close(self):
+        if self._snapshot is not None:
+            self._snapshot.close()
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Aynı makinedeki tüm uvicorn worker'larının ortak kullandığı önbellek.
+    SQLite WAL modunda çalışır: okuyucular birbirini beklemez, yazmalar
+    tek bir SQL ifadesi olduğu için atomiktir. Her kaydın kendi TTL'i vardır.
+    Sorgular event loop'u bloklamasın diye thread havuzunda çalışır.
+    """
+
+    def __init__(self, path: str, default_ttl: int):
+        super().__init__()
+        self.path = path
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
         )
-        
-        cleaned_json = clean_json_response(response.text)
-        menu_data = json.loads(cleaned_json)
-        
-        return menu_data
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires_at)")
 
-    except Exception as e:
-        print(f"HATA (Menu): {e}")
-        raise HTTPException(status_code=500, detail=f"Menü oluşturulamadı: {str(e)}")
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 bağlantıları thread'ler arasında paylaşılmamalı
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
 
+    def _get(self, key: str):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+            (key, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
 
-# 2. TARİF ÜRETME (MALZEMEYE GÖRE) - GÜNCELLENDİ ✅
-@app.post("/generate-recipe/")
-async def generate_recipe(request: IngredientRequest):
-    malzeme_listesi = ", ".join(request.ingredients)
-    kategori = request.kategori
-    diyet_notu = request.diet_info # Frontend'den gelen diyet bilgisi
-    
-    recipe_prompt = (
-        f"Sen profesyonel bir şefsin. Elimdeki malzemeler: {malzeme_listesi}. "
-        f"İstediğim kategori: {kategori}. "
-        f"⚠️ DİKKAT EDİLMESİ GEREKEN KISITLAMALAR: {diyet_notu} "
-        "Bu malzemelerle (ve varsa kısıtlamalara uyarak) yapılabilecek en iyi ve yaratıcı Türk mutfağı tarifini oluştur. "
-        "Eğer kısıtlamalar yüzünden bu malzemeler kullanılamıyorsa, uygun alternatifler önererek tarifi oluştur."
-        
-        "Cevabı SADECE aşağıdaki JSON formatında döndür:"
-        "{"
-        "  'yemekAdi': 'Yemeğin Adı',"
-        "  'aciklama': 'Kısa, iştah açıcı bir açıklama',"
-        "  'sure': 'Hazırlama süresi (örn: 45 dk)',"
-        "  'kalori': 'Tahmini kalori (örn: 350 kcal)',"
-        "  'malzemeler': ['malzeme1', 'malzeme2', '...'],"
-        "  'tarif': ['Adım 1: ...', 'Adım 2: ...', '...'],"
-        "  'image_prompt': '[Yemeğin Tam Türkçe Adı] nefis yemek sunumu'"
-        "}"
-    )
+    def _set(self, key: str, value, ttl: int | None = None):
+        expires_at = time.time() + (ttl or self.default_ttl)
+        self._conn().execute(
+            "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
 
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=recipe_prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
+    def _delete(self, key: str):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _purge_expired(self) -> int:
+        cursor = self._conn().execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def _get_with_ttl(self, key: str):
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return (json.loads(row[0]), row[1] - now) if row else (None, None)
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def get_with_ttl(self, key: str) -> tuple[object, float | None]:
+        return await asyncio.to_thread(self._get_with_ttl, key)
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+    async def purge_expired(self) -> int:
+        return await asyncio.to_thread(self._purge_expired)
+
+
+class RedisCache(CacheBackend):
+    """
+    Redis protokolü (RESP) konuşan minimal istemci. Ek bağımlılık gerektirmez;
+    Redis, KeyDB, Dragonfly veya testler için yerel sahte bir sunucuyla çalışır.
+    """
+
+    def __init__(self, url: str, default_ttl: int, prefix: str = "biseyleryap:"):
+        super().__init__()
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.default_ttl = default_ttl
+        self.prefix = prefix
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis bağlantısı kapandı")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RuntimeError(f"Redis hatası: {body.decode('utf-8')}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length == -1:
+                return None
+            return (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(body)
+            if length == -1:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Beklenmeyen Redis cevabı: {line!r}")
+
+    async def _send(self, *args):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _command(self, *args):
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                    if self.password:
+                        await self._send("AUTH", self.password)
+                    if self.db:
+                        await self._send("SELECT", self.db)
+                return await self._send(*args)
+            except BaseException:
+                # İptal (CancelledError / wait_for) dahil her yarıda kalışta cevap okunmamış kalabilir;
+                # bağlantı atılmazsa sonraki komut bu cevabı kendi cevabı sanar.
+                await self._reset()
+                raise
+
+    async def _reset(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def get(self, key: str):
+        raw = await self._command("GET", self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def get_with_ttl(self, key: str) -> tuple[object, float | None]:
+        value = await self.get(key)
+        if value is None:
+            return None, None
+        # -2: bu arada süresi doldu, -1: süresiz (bu sınıf her zaman EX ile yazar)
+        pttl = await self._command("PTTL", self.prefix + key)
+        if pttl == -2:
+            return None, None
+        return value, (pttl / 1000 if pttl > 0 else None)
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        await self._command(
+            "SET", self.prefix + key, json.dumps(value, ensure_ascii=False),
+            "EX", ttl or self.default_ttl,
         )
-        
-        cleaned_json = clean_json_response(response.text)
-        recipe_data = json.loads(cleaned_json)
-        
-        return recipe_data
 
-    except Exception as e:
-        print(f"HATA (Tarif): {e}")
-        raise HTTPException(status_code=500, detail=f"Tarif oluşturulamadı: {str(e)}")
+    async def delete(self, key: str):
+        await self._command("DEL", self.prefix + key)
 
+    async def close(self):
+        async with self._lock:
+            await self._reset()
+
+
+class TieredCache(CacheBackend):
+    """
+    İki kademeli önbellek: L1 process içi (hızlı), L2 paylaşımlı (SQLite/Redis).
+    Okuma L1 -> L2 sırasıyla yapılır, L2'de bulunan kayıt L1'e de yazılır.
+    Yazma L1'e hemen, L2'ye arka planda (write-behind) gider.
+    """
+
+    def __init__(self, l1: CacheBackend, l2: CacheBackend, default_ttl: int):
+        super().__init__()
+        self.l1 = l1
+        self.l2 = l2
+        self.default_ttl = default_ttl
+        self._queue: asyncio.Queue | None = None
+        self._writer_task: asyncio.Task | None = None
+
+    async def get(self, key: str):
+        value = await self.l1.get(key)
+        if value is not None:
+            return value
+        value, remaining = await self.l2.get_with_ttl(key)
+        if value is not None:
+            # L1'e kaydın kalan süresiyle yazılır; varsayılan TTL ile yazılsa kısa ömürlü kayıtlar
+            # (örn. 15 dk'lık neg: kayıtları) her worker'da bir hafta yaşardı
+            await self.l1.set(key, value, remaining)
+        return value
+
+    async def set(self, key: str, value, ttl: int | None = None):
+        await self.l1.set(key, value, ttl)
+        if self._writer_task is None:
+            self._queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._write_behind())
+        self._queue.put_nowait((key, value, ttl))
+
+    async def delete(self, key: str):
+        await self.l1.delete(key)
+        await self.l2.delete(key)
+
+    async def _write_behind(self):
+        while True:
+            key, value, ttl = await self._queue.get()
+            try:
+                await self.l2.set(key, value, ttl)
+            except Exception as e:
+                print(f"HATA (L2 yazma): {e}")
+            finally:
+                self._queue.task_done()
+
+    def attach_snapshot(self, path: str):
+        self.l1.attach_snapshot(path)
+
+    async def save_snapshot(self, path: str, max_entries: int):
+        await self.l1.save_snapshot(path, max_entries)
+
+    async def purge_expired(self) -> int:
+        return await self.l1.purge_expired() + await self.l2.purge_expired()
+
+    async def close(self):
+        # Kapanırken kuyrukta bekleyen yazmaları L2'ye boşalt
+        if self._writer_task is not None:
+            await self._queue.join()
+            self._writer_task.cancel()
+            self._writer_task = None
+        await self.l1.close()
+        await self.l2.close()
+
+
+def build_cache(kind: str) -> CacheBackend:
+    """CACHE_BACKEND ayarına göre önbellek katmanını oluşturur."""
+    if kind == "memory":
+        admission = FrequencySketch(MEMORY_CACHE_MAX_ENTRIES * 4) if CACHE_ADMISSION == "tinylfu" else None
+        return MemoryCache(MEMORY_CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS, admission)
+    if kind == "sqlite":
+        return SQLiteCache(CACHE_PATH, CACHE_TTL_SECONDS)
+    if kind == "redis":
+        return RedisCache(REDIS_URL, CACHE_TTL_SECONDS)
+    if kind == "tiered":
+        return TieredCache(build_cache("memory"), build_cache(CACHE_L2_BACKEND), CACHE_TTL_SECONDS)
+    raise ValueError(f"Bilinmeyen önbellek türü: {kind}")
+
+
+cache_admission_stats = Counter()
+recipe_cache = build_cache(CACHE_BACKEND)
+
+# En çok istenen yemekler / malzeme setleri (ön üretim adayları)
+request_popularity = FrequencySketch(POPULARITY_SKETCH_WIDTH, top_k=POPULARITY_TOP_K)
 
-# 3. YEMEK İSMİNDEN TARİF - GÜNCELLENDİ ✅
-@app.post("/generate-recipe-by-name/")
-async def generate_recipe_by_name(request: DishRequest):
-    yemek_ismi = request.dish_name
-    diyet_notu = request.diet_info # Frontend'den gelen diyet bilgisi
-    
-    recipe_prompt = (
-        f"Sen profesyonel bir şefsin. Kullanıcı '{yemek_ismi}' yapmak istiyor. "
-        f"⚠️ DİKKAT EDİLMESİ GEREKEN KISITLAMALAR: {diyet_notu} "
-        "Bu yemek için (varsa kısıtlamalara uyarak) en orijinal ve lezzetli tarifi oluştur. "
-        "Örneğin kullanıcı 'Lahmacun' istediyse ama kısıtlamada 'Vegan' varsa, 'Vegan Lahmacun (Mercimekli)' tarifi ver. "
-        "Kısıtlama yoksa orijinal tarifi ver."
-        
-        "Cevabı SADECE aşağıdaki JSON formatında döndür:"
-        "{"
-        "  'yemekAdi': 'Yemeğin Adı (Gerekirse Vegan/Glutensiz ibaresi ekle)',"
-        "  'aciklama': 'Kısa, iştah açıcı bir açıklama',"
-        "  'sure': 'Hazırlama süresi (örn: 45 dk)',"
-        "  'kalori': 'Tahmini kalori (örn: 350 kcal)',"
-        "  'malzemeler': ['malzeme1', 'malzeme2', '...'],"
-        "  'tarif': ['Adım 1: ...', 'Adım 2: ...', '...'],"
-        "  'image_prompt': '[Yemeğin Tam Türkçe Adı] nefis yemek sunumu'"
-        "}"
-    )
 
+async def save_cache_snapshot():
     try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=recipe_prompt,
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json"
-            )
+        await recipe_cache.save_snapshot(CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_MAX_ENTRIES)
+    except Exception as e:
+        print(f"HATA (önbellek görüntüsü): {e}")
+
+
+async def cache_snapshot_loop():
+    """Çökme/ani kapanma durumunda da yakın tarihli bir görüntü kalsın diye periyodik yazar."""
+    while True:
+        await asyncio.sleep(CACHE_SNAPSHOT_SECONDS)
+        await save_cache_snapshot()
+
+
+async def cache_purge_loop():
+    """SQLite önbellekte süresi dolan satırlar okumada gizlenir ama silinmez; dosya büyümesin diye periyodik temizlenir."""
+    while True:
+        try:
+            removed = await recipe_cache.purge_expired()
+            if removed:
+                print(f"Önbellek: süresi dolmuş {removed} kayıt silindi")
+        except Exception as e:
+            print(f"HATA (önbellek temizliği): {e}")
+        await asyncio.sleep(CACHE_PURGE_SECONDS)
+
+# ---------------------------------------------------------
+# TARİF DEPOSU (Kalıcı tarif kataloğu)
+# ---------------------------------------------------------
+
+RECIPE_FIELDS = {
+    "yemekAdi": str,
+    "aciklama": str,
+    "sure": str,
+    "kalori": str,
+    "malzemeler": list,
+    "tarif": list,
+    "image_prompt": str,
+}
+
+def validate_recipe(data) -> list[str]:
+    """Tarif şemaya uymuyorsa hatalı/eksik alanların adlarını döndürür (boş liste = geçerli)."""
+    if not isinstance(data, dict):
+        return list(RECIPE_FIELDS)
+    invalid = []
+    for field, expected in RECIPE_FIELDS.items():
+        value = data.get(field)
+        if not isinstance(value, expected) or not value:
+            invalid.append(field)
+        elif expected is list and not all(isinstance(item, str) and item.strip() for item in value):
+            invalid.append(field)
+    return invalid
+
+
+RECIPE_SCHEMA_HINTS = {
+    "yemekAdi": "Yemeğin Adı",
+    "aciklama": "Kısa, iştah açıcı bir açıklama",
+    "sure": "Hazırlama süresi (örn: 45 dk)",
+    "kalori": "Tahmini kalori (örn: 350 kcal)",
+    "malzemeler": ["200 gr malzeme1", "2 adet malzeme2", "..."],
+    "tarif": ["Adım 1: ...", "Adım 2: ...", "..."],
+    "image_prompt": "[Yemeğin Tam Türkçe Adı] nefis yemek sunumu",
+}
+
+def recipe_schema(fields: set[str] | None = None, **hints) -> str:
+    """Prompt'taki JSON şablonunu sadece istenen alanlarla oluşturur."""
+    hints = {**RECIPE_SCHEMA_HINTS, **hints}
+    selected = [f for f in RECIPE_FIELDS if fields is None or f in fields]
+    return "{" + ",".join(f"  '{f}': {hints[f]!r}" for f in selected) + "}"
+
+def requested_fields(fields: list[str] | None) -> set[str] | None:
+    """
+    İstenen alan listesini doğrular. Hepsi isteniyorsa None döner (tam mod);
+    yemekAdi her zaman dahil edilir, kısmi kayıtlar onunla eşleştirilir.
+    """
+    if not fields:
+        return None
+    unknown = [f for f in fields if f not in RECIPE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Bilinmeyen alan(lar): {', '.join(unknown)}")
+    selected = set(fields) | {"yemekAdi"}
+    return None if selected == set(RECIPE_FIELDS) else selected
+
+def project_recipe(data: dict, fields: set[str] | None) -> dict:
+    if fields is None:
+        return data
+    return {k: v for k, v in data.items() if k in fields}
+
+def merge_recipe_fields(cached: dict, fresh: dict) -> dict:
+    """Aynı yemeğe ait kısmi kayıtları birleştirir; yemek farklıysa yenisi geçerlidir."""
+    if normalize_text(str(cached.get("yemekAdi", ""))) != normalize_text(str(fresh.get("yemekAdi", ""))):
+        return fresh
+    merged = {**cached, **fresh}
+    # Alan sırası tam tariftekiyle aynı kalsın
+    return {**{f: merged[f] for f in RECIPE_FIELDS if f in merged}, **merged}
+
+def output_token_limit(fields: set[str] | None) -> int:
+    return MAX_OUTPUT_TOKENS_COMPACT if fields is not None else MAX_OUTPUT_TOKENS_FULL
+
+
+# ---------------------------------------------------------
+# BESİN DEĞERİ MOTORU (Malzemelerden yerel kalori / makro hesabı)
+# ---------------------------------------------------------
+
+# Model yerine yerelde hesaplanan alanlar; prompt'tan çıkarılır
+COMPUTED_FIELDS = {"kalori"}
+NUTRIENTS = ("kalori", "protein", "karbonhidrat", "yag")
+
+# Ölçü birimleri -> gram. "adet" ve "paket" malzemeye göre değişir (tablodaki adet_gram / paket_gram);
+# hacim ölçüleri (ml cinsinden) malzemenin yoğunluğu ile çarpılır.
+WEIGHT_UNITS = {"kg": 1000, "kilo": 1000, "kilogram": 1000, "gram": 1, "gr": 1, "g": 1}
+VOLUME_UNITS = {
+    "su bardağı": 200, "çay bardağı": 100, "kahve fincanı": 60, "fincan": 60, "kase": 250,
+    "yemek kaşığı": 15, "tatlı kaşığı": 8, "çay kaşığı": 4, "kahve kaşığı": 2,
+    "litre": 1000, "lt": 1000, "ml": 1, "cc": 1,
+}
+FIXED_UNITS = {"diş": 5, "demet": 50, "tutam": 1, "dilim": 30, "avuç": 30, "dal": 5, "yaprak": 2, "kutu": 400}
+PIECE_UNITS = {"adet", "tane", "baş", "orta boy", "büyük boy", "küçük boy", "iri", "orta"}
+QUANTITY_WORDS = {
+    "yarım": 0.5, "çeyrek": 0.25, "bir": 1, "iki": 2, "üç": 3, "dört": 4, "beş": 5, "altı": 6,
+    "yedi": 7, "sekiz": 8, "dokuz": 9, "on": 10, "birkaç": 3,
+}
+# Miktarı hiç yazılmamış satırın birimi ("Zeytinyağı"): 0 g sayılır, sonuç yaklaşık işaretlenir
+UNQUANTIFIED = "?"
+NO_QUANTITY_MARKERS = ("isteğe göre", "isteğe bağlı", "göz kararı", "yeteri kadar", "az miktar")
+
+_NUMBER = r"\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?"
+_UNIT_PATTERN = "|".join(
+    re.escape(u) for u in sorted({*WEIGHT_UNITS, *VOLUME_UNITS, *FIXED_UNITS, *PIECE_UNITS, "paket"}, key=len, reverse=True)
+)
+QUANTITY_RE = re.compile(
+    rf"(?<!\w)(?P<qty>{_NUMBER}(?:\s*-\s*{_NUMBER})?|{'|'.join(QUANTITY_WORDS)})?\s*"
+    rf"(?:buçuk\s*)?(?P<unit>{_UNIT_PATTERN})?(?!\w)"
+)
+SERVINGS_RE = re.compile(r"(\d+)\s*(?:kişilik|porsiyon)")
+
+
+def parse_number(text: str) -> float:
+    text = text.replace(",", ".").replace(" ", "")
+    if "-" in text:
+        low, high = text.split("-", 1)
+        return (parse_number(low) + parse_number(high)) / 2
+    if "/" in text:
+        num, den = text.split("/", 1)
+        return float(num) / float(den) if float(den) else 0.0
+    return float(text)
+
+
+class NutritionEngine:
+    """
+    Paketle gelen besin tablosu (nutrition.csv, 100 g başına değerler) ve miktar ayrıştırıcısı.
+    Malzeme satırları Python'da ayrıştırılır; gram hesabı ve toplama NumPy ile tek seferde yapılır.
+    """
+
+    def __init__(self, path: str):
+        names, aliases, values, piece_grams, package_grams, densities = [], [], [], [], [], []
+        with open(path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                index = len(names)
+                names.append(row["ad"])
+                for alias in [row["ad"], *row["esanlamlilar"].split("|")]:
+                    if alias.strip():
+                        aliases.append((normalize_text(alias), index))
+                values.append([float(row[n]) for n in NUTRIENTS])
+                piece_grams.append(float(row["adet_gram"] or 50))
+                package_grams.append(float(row["paket_gram"] or 100))
+                densities.append(float(row["yogunluk"] or 1))
+        self.names = names
+        self.values = np.array(values, dtype=np.float64)        # (malzeme, besin) / 100 g
+        self.piece_grams = np.array(piece_grams, dtype=np.float64)
+        self.package_grams = np.array(package_grams, dtype=np.float64)
+        self.densities = np.array(densities, dtype=np.float64)
+        # Uzun adlar önce denenir: "domates salçası" "domates"ten önce eşleşir
+        aliases.sort(key=lambda a: len(a[0]), reverse=True)
+        self._alias_index = dict(aliases)
+        # Örtüşen eşleşmeler de bulunsun diye lookahead; satırdaki en uzun ad seçilir (bkz. _find_alias)
+        self._alias_re = re.compile(
+            r"(?=(?<!\w)(" + "|".join(re.escape(a) for a, _ in aliases) + ")" + INGREDIENT_SUFFIX + ")"
         )
-        cleaned_json = clean_json_response(response.text)
-        return json.loads(cleaned_json)
 
-    except Exception as e:
-        print(f"HATA (İsimden Tarif): {e}")
-        raise HTTPException(status_code=500, detail=f"Tarif oluşturulamadı: {str(e)}")
+    def _find_alias(self, text: str) -> str | None:
+        """Satırdaki en uzun malzeme adı: "tavuk suyu" "tavuk"tan, "kırmızı mercimek" "kırmızı biber"den önce gelir."""
+        return max((m.group(1) for m in self._alias_re.finditer(text)), key=len, default=None)
+
+    def parse_line(self, line: str) -> tuple[int, float, str]:
+        """
+        Satırı (malzeme indeksi ya da -1, miktar, birim) olarak ayrıştırır.
+        "isteğe göre" gibi satırlar ihmal edilir (birim ""); hiç miktar yazılmamış satırlara
+        gram uydurulmaz, birim UNQUANTIFIED olur ve toplam yaklaşık sayılır.
+        """
+        text = normalize_text(line)
+        if any(marker in text for marker in NO_QUANTITY_MARKERS):
+            qty, unit = 0.0, ""
+        else:
+            qty, unit = 0.0, UNQUANTIFIED
+            for match in QUANTITY_RE.finditer(text):
+                if match.group("qty") or match.group("unit"):
+                    raw_qty = match.group("qty")
+                    if raw_qty:
+                        qty = QUANTITY_WORDS[raw_qty] if raw_qty in QUANTITY_WORDS else parse_number(raw_qty)
+                    if "buçuk" in match.group(0):
+                        qty += 0.5
+                    unit = match.group("unit") or "adet"
+                    text = text[:match.start()] + " " + text[match.end():]
+                    break
+        found = self._find_alias(text)
+        return (self._alias_index[found] if found else -1), qty, unit
+
+    def ingredient_names(self, malzemeler: list[str]) -> set[str]:
+        """Malzeme satırlarının tablodaki kanonik adları (eşleşmeyenler atlanır)."""
+        return {self.names[index] for index, _, _ in map(self.parse_line, malzemeler) if index >= 0}
+
+    def canonical_name(self, text: str) -> str:
+        found = self._find_alias(normalize_text(text))
+        return self.names[self._alias_index[found]] if found else normalize_text(text)
+
+    def _grams(self, indexes: np.ndarray, quantities: np.ndarray, units: list[str]) -> np.ndarray:
+        safe = np.where(indexes >= 0, indexes, 0)
+        per_unit = np.array([
+            WEIGHT_UNITS.get(unit) or FIXED_UNITS.get(unit) or VOLUME_UNITS.get(unit) or 0.0 for unit in units
+        ])
+        is_volume = np.array([unit in VOLUME_UNITS for unit in units], dtype=bool)
+        is_piece = np.array([unit in PIECE_UNITS for unit in units], dtype=bool)
+        is_package = np.array([unit == "paket" for unit in units], dtype=bool)
+        per_unit = np.where(is_volume, per_unit * self.densities[safe], per_unit)
+        per_unit = np.where(is_piece, self.piece_grams[safe], per_unit)
+        per_unit = np.where(is_package, self.package_grams[safe], per_unit)
+        return np.where(indexes >= 0, quantities * per_unit, 0.0)
+
+    def analyze_many(self, recipes: list[list[str]]) -> list[dict]:
+        """Birden çok tarifin malzeme listesini tek bir vektörel hesapla analiz eder."""
+        lines = [line for malzemeler in recipes for line in malzemeler]
+        owners = np.repeat(np.arange(len(recipes)), [len(m) for m in recipes])
+        parsed = [self.parse_line(line) for line in lines]
+        indexes = np.array([p[0] for p in parsed], dtype=np.int64)
+        quantities = np.array([p[1] for p in parsed], dtype=np.float64)
+        grams = self._grams(indexes, quantities, [p[2] for p in parsed])
+        per_line = self.values[np.where(indexes >= 0, indexes, 0)] * (grams / 100)[:, None]
+        totals = np.zeros((len(recipes), len(NUTRIENTS)))
+        np.add.at(totals, owners, per_line)
+
+        results = []
+        for r, malzemeler in enumerate(recipes):
+            rows = np.flatnonzero(owners == r)
+            results.append({
+                "toplam": {n: round(float(v), 1) for n, v in zip(NUTRIENTS, totals[r])},
+                "malzemeler": [
+                    {
+                        "satir": lines[i],
+                        "eslesen": self.names[indexes[i]] if indexes[i] >= 0 else None,
+                        "gram": round(float(grams[i]), 1),
+                        "kalori": round(float(per_line[i, 0]), 1),
+                    }
+                    for i in rows
+                ],
+                "eslesmeyen": [lines[i] for i in rows if indexes[i] < 0],
+                "miktarsiz": [lines[i] for i in rows if indexes[i] >= 0 and parsed[i][2] == UNQUANTIFIED],
+                # Eşleşen satırların oranı; eşleşmeyenler 0 g sayıldığı için düşükse toplam da eksiktir
+                "kapsam": round(float(np.mean(indexes[rows] >= 0)), 2) if len(rows) else 0.0,
+            })
+        return results
+
+    def analyze(self, malzemeler: list[str], servings: int | None = None) -> dict:
+        result = self.analyze_many([malzemeler])[0]
+        servings = servings or NUTRITION_DEFAULT_SERVINGS
+        result["porsiyon"] = servings
+        result["porsiyon_basi"] = {n: round(v / servings, 1) for n, v in result["toplam"].items()}
+        return result
+
+
+def recipe_servings(data: dict) -> int | None:
+    """Tarif metninde "4 kişilik" gibi bir ifade varsa porsiyon sayısını döner."""
+    text = normalize_text(" ".join(str(data.get(f, "")) for f in ("yemekAdi", "aciklama")))
+    match = SERVINGS_RE.search(text)
+    return int(match.group(1)) if match and int(match.group(1)) > 0 else None
+
+
+def with_nutrition(data: dict) -> dict:
+    """
+    Tarifin kalori alanını malzemelerden hesaplanan kişi başı değerle doldurur
+    (NUTRITION_MODE=replace ise modelin verdiği değerin yerine geçer). Yeni sözlük döner.
+    """
+    malzemeler = data.get("malzemeler")
+    if not isinstance(malzemeler, list):
+        # Kısmi (fields=...) üretimde kalori istenmediyse malzemeler de gelmez; yer tutucu yazılırsa
+        # önbellekteki kayıt sonraki "kalori" isteğinde isabet sayılırdı
+        return data
+    if not malzemeler:
+        return data if data.get("kalori") else {**data, "kalori": "Bilinmiyor"}
+    if data.get("kalori") and NUTRITION_MODE != "replace":
+        return data
+    analysis = nutrition_engine.analyze([str(m) for m in malzemeler], recipe_servings(data))
+    kcal = analysis["porsiyon_basi"]["kalori"]
+    if kcal > 0 and analysis["kapsam"] >= NUTRITION_MIN_MATCHED:
+        # Eşleşmeyen ya da miktarı yazılmamış satır varsa değer yaklaşıktır (aramada/menüde yine sayı olarak okunur)
+        approximate = analysis["eslesmeyen"] or analysis["miktarsiz"]
+        kalori = f"~{round(kcal)} kcal" if approximate else f"{round(kcal)} kcal"
+    else:
+        # Malzemelerin çoğu bilinmiyorsa eksik toplam yerine modelin değeri ya da "Bilinmiyor"
+        kalori = data.get("kalori") or "Bilinmiyor"
+    updated = {**data, "kalori": kalori}
+    return {**{f: updated[f] for f in RECIPE_FIELDS if f in updated}, **updated}
+
+
+def generation_fields(alanlar: set[str] | None) -> set[str]:
+    """Modelden istenecek alanlar: hesaplanan alanlar çıkarılır, onlar için malzemeler eklenir."""
+    wanted = set(RECIPE_FIELDS) if alanlar is None else set(alanlar)
+    if wanted & COMPUTED_FIELDS:
+        wanted |= {"malzemeler"}
+    return wanted - COMPUTED_FIELDS
+
+
+nutrition_engine = NutritionEngine(NUTRITION_TABLE_PATH)
+
+
+# ---------------------------------------------------------
+# TARİF KATALOĞU VE ARAMA İNDEKSLERİ
+# ---------------------------------------------------------
+
+# İndeksleme mantığı değişince artırılır; eski sürümdeki kayıtlar açılışta yeniden indekslenir
+RECIPE_INDEX_VERSION = 3
+
+_DURATION_RE = re.compile(
+    rf"(?<!\w)(?P<qty>{_NUMBER}(?:\s*-\s*{_NUMBER})?|yarım|bir)?\s*(?P<buc>buçuk\s*)?"
+    r"(?P<unit>saat|sa|dakika|dak|dk|min)(?!\w)"
+)
+_FIRST_NUMBER_RE = re.compile(rf"{_NUMBER}(?:\s*-\s*{_NUMBER})?")
+
+
+def parse_minutes(text: str) -> int | None:
+    """'45 dk', '1 saat 15 dakika', '1,5 saat', 'yarım saat' gibi ifadeleri dakikaya çevirir."""
+    text = normalize_text(str(text or ""))
+    total, found = 0.0, False
+    for match in _DURATION_RE.finditer(text):
+        raw = match.group("qty")
+        qty = QUANTITY_WORDS[raw] if raw in QUANTITY_WORDS else (parse_number(raw) if raw else 1.0)
+        if match.group("buc"):
+            qty += 0.5
+        total += qty * (60 if match.group("unit") in ("saat", "sa") else 1)
+        found = True
+    if not found:
+        number = _FIRST_NUMBER_RE.search(text)
+        if number is None:
+            return None
+        total = parse_number(number.group(0))
+    return round(total)
+
+
+def parse_kcal(text: str) -> int | None:
+    """'350 kcal', '300-400 kalori' gibi ifadelerden sayısal kaloriyi çıkarır."""
+    number = _FIRST_NUMBER_RE.search(normalize_text(str(text or "")))
+    return round(parse_number(number.group(0))) if number else None
+
+
+class RecipeStore:
+    """
+    Üretilen ve önceden hazırlanan (pre-generate) tariflerin kalıcı deposu.
+    Önbellekten farklı olarak TTL yoktur; önbellek boşaldığında tarif buradan
+    okunur, böylece popüler yemekler için Gemini'ye hiç gidilmez.
+    Yazarken süre/kalori sayıya, diyet bit kümesine çevrilir; kategori ve malzemeler
+    ayrı indekslenir, böylece arama LLM'siz ve milisaniyeler içinde yapılır.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS recipes ("
+            " key TEXT PRIMARY KEY,"
+            " dish_name TEXT NOT NULL,"
+            " diet_info TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " source TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        # Eski depolara arama sütunları sonradan eklenir
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(recipes)")}
+        for column, ddl in (
+            ("sure_dk", "INTEGER"),
+            ("kalori_kcal", "INTEGER"),
+            ("kategori", "TEXT NOT NULL DEFAULT ''"),
+            ("mevsim", "TEXT NOT NULL DEFAULT ''"),
+            ("diet_bits", "INTEGER NOT NULL DEFAULT 0"),
+            ("index_version", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE recipes ADD COLUMN {column} {ddl}")
+        conn.execute("CREATE INDEX IF NOT EXISTS recipes_sure ON recipes(sure_dk)")
+        conn.execute("CREATE INDEX IF NOT EXISTS recipes_kalori ON recipes(kalori_kcal)")
+        conn.execute("CREATE INDEX IF NOT EXISTS recipes_kategori ON recipes(kategori, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS recipes_created ON recipes(created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS recipes_course ON recipes(kategori, mevsim)")
+        # Menü motoru: hangi istemciye hangi yemeğin ne zaman sunulduğu
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS menu_history ("
+            " client_id TEXT NOT NULL, key TEXT NOT NULL, served_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS menu_history_client ON menu_history(client_id, served_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS recipe_ingredients ("
+            " ingredient TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (ingredient, key))"
+        )
+        self._reindex_stale()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str):
+        row = self._conn().execute("SELECT data FROM recipes WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put_many(self, rows: list[tuple], source: str):
+        """rows: (key, dish_name, diet_info, data), isteğe bağlı olarak sonunda kategori ve mevsim."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            for key, dish_name, diet_info, data, *rest in rows:
+                kategori, mevsim = (*rest, "", "")[:2]
+                conn.execute(
+                    "INSERT OR REPLACE INTO recipes (key, dish_name, diet_info, data, source, created_at, kategori, mevsim) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, dish_name, diet_info, json.dumps(data, ensure_ascii=False), source, now, kategori, mevsim),
+                )
+                self._index(conn, key, diet_info, data)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _index(self, conn: sqlite3.Connection, key: str, diet_info: str, data: dict):
+        conn.execute(
+            "UPDATE recipes SET sure_dk = ?, kalori_kcal = ?, diet_bits = ?, index_version = ? WHERE key = ?",
+            (parse_minutes(data.get("sure")), parse_kcal(data.get("kalori")), parse_diet(diet_info).bits,
+             RECIPE_INDEX_VERSION, key),
+        )
+        conn.execute("DELETE FROM recipe_ingredients WHERE key = ?", (key,))
+        malzemeler = data.get("malzemeler") if isinstance(data.get("malzemeler"), list) else []
+        conn.executemany(
+            "INSERT INTO recipe_ingredients (ingredient, key) VALUES (?, ?)",
+            [(name, key) for name in nutrition_engine.ingredient_names([str(m) for m in malzemeler])],
+        )
+
+    def _reindex_stale(self):
+        conn = self._conn()
+        stale = conn.execute(
+            "SELECT key, diet_info, data FROM recipes WHERE index_version < ?", (RECIPE_INDEX_VERSION,)
+        ).fetchall()
+        if not stale:
+            return
+        conn.execute("BEGIN")
+        try:
+            for key, diet_info, data in stale:
+                self._index(conn, key, diet_info, json.loads(data))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"Tarif deposu: {len(stale)} kayıt yeniden indekslendi")
+
+    def _search(self, filters: dict, sort: str, limit: int, offset: int) -> tuple[int, list[dict]]:
+        where, params = [], []
+        for column, op, name in (
+            ("sure_dk", "<=", "max_sure"), ("sure_dk", ">=", "min_sure"),
+            ("kalori_kcal", "<=", "max_kalori"), ("kalori_kcal", ">=", "min_kalori"),
+        ):
+            if filters.get(name) is not None:
+                where.append(f"{column} {op} ?")
+                params.append(filters[name])
+        if filters.get("kategori"):
+            where.append("kategori = ?")
+            params.append(normalize_text(filters["kategori"]))
+        if filters.get("q"):
+            where.append("dish_name LIKE ?")
+            params.append(f"%{normalize_text(filters['q'])}%")
+        if filters.get("diet_bits"):
+            where.append("(diet_bits & ?) = ?")
+            params += [filters["diet_bits"], filters["diet_bits"]]
+        for ingredient in filters.get("ingredients") or []:
+            where.append("key IN (SELECT key FROM recipe_ingredients WHERE ingredient = ?)")
+            params.append(nutrition_engine.canonical_name(ingredient))
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        order = {
+            "sure": "sure_dk IS NULL, sure_dk, key",
+            "kalori": "kalori_kcal IS NULL, kalori_kcal, key",
+        }.get(sort, "created_at DESC, key")
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM recipes {clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT data, sure_dk, kalori_kcal FROM recipes {clause} ORDER BY {order} LIMIT ? OFFSET ?",
+            [*params, limit, offset],
+        ).fetchall()
+        return total, [{**json.loads(data), "sure_dk": sure, "kalori_kcal": kcal} for data, sure, kcal in rows]
+
+    def _existing_keys(self, keys: list[str]) -> set[str]:
+        found = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(
+                row[0] for row in self._conn().execute(
+                    f"SELECT key FROM recipes WHERE key IN ({placeholders})", chunk
+                )
+            )
+        return found
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def put(self, key: str, dish_name: str, diet_info: str, data: dict, source: str = "live", kategori: str = ""):
+        await asyncio.to_thread(self._put_many, [(key, dish_name, diet_info, data, kategori)], source)
+
+    async def put_many(self, rows: list[tuple[str, str, str, dict]], source: str = "pregenerate"):
+        """Tek transaction içinde toplu yükleme."""
+        await asyncio.to_thread(self._put_many, rows, source)
+
+    async def existing_keys(self, keys: list[str]) -> set[str]:
+        return await asyncio.to_thread(self._existing_keys, keys)
+
+    def _course_candidates(self, kategori: str, mevsim: str, exclude: list[str], limit: int) -> list[tuple[str, dict]]:
+        """Mevsime uygun (ya da mevsimsiz) yemeklerden rastgele bir örneklem; exclude'dakiler hariç."""
+        placeholders = ",".join("?" * len(exclude))
+        rows = self._conn().execute(
+            "SELECT key, data FROM recipes WHERE kategori = ? AND mevsim IN (?, '') "
+            f"AND key NOT IN ({placeholders}) ORDER BY RANDOM() LIMIT ?",
+            [kategori, mevsim, *exclude, limit],
+        ).fetchall()
+        return [(key, json.loads(data)) for key, data in rows]
+
+    def _course_count(self, kategori: str, mevsim: str) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM recipes WHERE kategori = ? AND mevsim IN (?, '')", (kategori, mevsim)
+        ).fetchone()[0]
+
+    def _course_names(self, kategori: str, mevsim: str, limit: int) -> list[str]:
+        rows = self._conn().execute(
+            "SELECT dish_name FROM recipes WHERE kategori = ? AND mevsim IN (?, '') ORDER BY created_at DESC LIMIT ?",
+            (kategori, mevsim, limit),
+        )
+        return [row[0] for row in rows]
+
+    def _recently_served(self, client_id: str, since: float) -> list[str]:
+        rows = self._conn().execute(
+            "SELECT DISTINCT key FROM menu_history WHERE client_id = ? AND served_at >= ?", (client_id, since)
+        )
+        return [row[0] for row in rows]
+
+    def _record_served(self, client_id: str, keys: list[str], keep_since: float):
+        conn = self._conn()
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO menu_history (client_id, key, served_at) VALUES (?, ?, ?)", [(client_id, k, now) for k in keys]
+        )
+        conn.execute("DELETE FROM menu_history WHERE served_at < ?", (keep_since,))
+
+    async def course_candidates(self, kategori: str, mevsim: str, exclude: list[str], limit: int):
+        return await asyncio.to_thread(self._course_candidates, kategori, mevsim, exclude, limit)
+
+    async def course_count(self, kategori: str, mevsim: str) -> int:
+        return await asyncio.to_thread(self._course_count, kategori, mevsim)
+
+    async def course_names(self, kategori: str, mevsim: str, limit: int = 40) -> list[str]:
+        return await asyncio.to_thread(self._course_names, kategori, mevsim, limit)
+
+    async def recently_served(self, client_id: str, since: float) -> list[str]:
+        return await asyncio.to_thread(self._recently_served, client_id, since)
+
+    async def record_served(self, client_id: str, keys: list[str], keep_since: float):
+        await asyncio.to_thread(self._record_served, client_id, keys, keep_since)
+
+    async def search(self, filters: dict, sort: str = "yeni", limit: int = 20, offset: int = 0) -> tuple[int, list[dict]]:
+        return await asyncio.to_thread(self._search, filters, sort, limit, offset)
+
+
+recipe_store = RecipeStore(RECIPE_STORE_PATH)
+
+
+# ---------------------------------------------------------
+# GEMINI HTTP BAĞLANTILARI (Paylaşılan havuz, keep-alive, ısıtma)
+# ---------------------------------------------------------
+
+class UpstreamHttp:
+    """
+    Worker başına tek bir httpx.AsyncClient: tüm API anahtarları ve endpointler
+    aynı bağlantı havuzunu kullanır, böylece TLS el sıkışması istek yoluna
+    sadece havuz boşken düşer. Bağlantı açma/yeniden kullanma sayaçları
+    httpcore trace olaylarından tutulur.
+    """
+
+    def __init__(self):
+        self.http2 = GEMINI_HTTP2 and h2 is not None
+        if GEMINI_HTTP2 and h2 is None:
+            print("UYARI: GEMINI_HTTP2=1 ama 'h2' paketi kurulu değil, HTTP/1.1 kullanılacak.")
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=GEMINI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=GEMINI_HTTP_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GEMINI_HTTP_KEEPALIVE_SECONDS,
+            ),
+            timeout=httpx.Timeout(GEMINI_HTTP_TIMEOUT_SECONDS, connect=GEMINI_HTTP_CONNECT_TIMEOUT_SECONDS),
+            event_hooks={"request": [self._on_request]},
+        )
+        self.stats = Counter()
+        self.connect_seconds = 0.0
+        self.last_request_at = 0.0
+
+    def http_options(self) -> types.HttpOptions:
+        # genai süre sınırını her isteğe ayrıca verir (milisaniye); verilmezse httpx'inki de devre dışı kalır
+        return types.HttpOptions(httpx_async_client=self.client, timeout=int(GEMINI_HTTP_TIMEOUT_SECONDS * 1000))
+
+    async def _on_request(self, request: httpx.Request):
+        self.stats["requests"] += 1
+        self.last_request_at = time.time()
+        # genai tek bir toplam süre verir; bağlantı kurma için daha kısa sınır uygulanır
+        timeout = dict(request.extensions.get("timeout") or {})
+        if timeout.get("connect") is None or timeout["connect"] > GEMINI_HTTP_CONNECT_TIMEOUT_SECONDS:
+            timeout["connect"] = GEMINI_HTTP_CONNECT_TIMEOUT_SECONDS
+        request.extensions["timeout"] = timeout
+        request.extensions["trace"] = self._tracer()
+
+    def _tracer(self):
+        """İstek başına trace geri çağrısı; yeni bağlantı kurulduysa kurulum süresini de ölçer."""
+        started = 0.0
+
+        async def trace(event: str, info: dict):
+            nonlocal started
+            if event == "connection.connect_tcp.started":
+                started = time.perf_counter()
+            elif event == "connection.connect_tcp.complete":
+                self.stats["new_connections"] += 1
+            elif event == "connection.start_tls.complete":
+                self.stats["tls_handshakes"] += 1
+                self.connect_seconds += time.perf_counter() - started
+            elif event.startswith("connection.") and event.endswith(".failed"):
+                self.stats["connect_errors"] += 1
+
+        return trace
+
+    async def keep_warm_loop(self):
+        """
+        Bir süredir Gemini'ye istek gitmediyse hafif bir model bilgisi isteği
+        (token harcamaz) göndererek havuzdaki bağlantıyı açık tutar.
+        """
+        turn = 0
+        while True:
+            await asyncio.sleep(GEMINI_KEEPWARM_SECONDS)
+            if time.time() - self.last_request_at < GEMINI_KEEPWARM_SECONDS:
+                continue
+            member = client_pool.members[turn % len(client_pool.members)]
+            turn += 1
+            try:
+                await member.client.aio.models.get(model=GEMINI_LIGHT_MODEL)
+                self.stats["keepwarm_pings"] += 1
+            except Exception as e:
+                self.stats["keepwarm_errors"] += 1
+                print(f"UYARI (bağlantı ısıtma): {e}")
+
+    def snapshot(self) -> dict:
+        requests = self.stats["requests"]
+        # Yeni bağlantı açmayan (ve bağlantı hatası almayan) her istek havuzdan bir bağlantıyı yeniden kullanmıştır
+        reused = max(0, requests - self.stats["new_connections"] - self.stats["connect_errors"])
+        return {
+            "http2": self.http2,
+            **dict(self.stats),
+            "reused_connections": reused,
+            "reuse_ratio": round(reused / requests, 3) if requests else None,
+            "avg_connect_ms": round(self.connect_seconds * 1000 / self.stats["tls_handshakes"], 1)
+            if self.stats["tls_handshakes"] else None,
+        }
+
+    async def close(self):
+        await self.client.aclose()
+
+
+upstream_http = UpstreamHttp()
+
+
+# ---------------------------------------------------------
+# GEMINI İSTEMCİ HAVUZU (Birden fazla API anahtarı)
+# ---------------------------------------------------------
+
+class PooledClient:
+    """Havuzdaki tek bir API anahtarı ve ona ait istemci + sayaçlar."""
+
+    def __init__(self, api_key: str):
+        # Anahtarlar farklı olsa da hepsi aynı HTTP bağlantı havuzunu paylaşır
+        self.client = genai.Client(api_key=api_key, http_options=upstream_http.http_options())
+        self.label = f"...{api_key[-4:]}"
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.consecutive_throttles = 0
+        self.ejected_until = 0.0
+        self.recent = deque()  # Son 60 saniyedeki istek zamanları (kota takibi)
+
+    def requests_last_minute(self, now: float) -> int:
+        while self.recent and self.recent[0] <= now - 60:
+            self.recent.popleft()
+        return len(self.recent)
+
+    def is_available(self, now: float) -> bool:
+        if self.ejected_until > now:
+            return False
+        return not GEMINI_KEY_RPM or self.requests_last_minute(now) < GEMINI_KEY_RPM
+
+
+class ClientPool:
+    """
+    Her API anahtarı için ayrı bir genai.Client tutar ve istekleri
+    en az bekleyen isteği olan anahtara yönlendirir (least-outstanding).
+    429 (kota) alan anahtar bir süreliğine havuzdan çıkarılır; art arda
+    429 aldıkça bu süre katlanarak uzar.
+    """
+
+    def __init__(self, api_keys: list[str], eject_seconds: float):
+        self.members = [PooledClient(key) for key in api_keys]
+        self.eject_seconds = eject_seconds
+
+    def pick(self) -> PooledClient:
+        """Sayaçlara dokunmadan en uygun anahtarı seçer (örn. uzun ömürlü sohbet oturumları için)."""
+        now = time.time()
+        available = [m for m in self.members if m.is_available(now)]
+        if available:
+            return min(available, key=lambda m: (m.outstanding, m.requests_last_minute(now)))
+        # Hepsi kısıtlıysa en erken geri dönecek olanı kullan
+        return min(self.members, key=lambda m: (m.ejected_until, m.outstanding))
+
+    def claim(self, member: PooledClient) -> PooledClient:
+        """Seçilen anahtar üzerinden başlayan bir isteği sayar; bitince release() çağrılmalı."""
+        member.outstanding += 1
+        member.requests += 1
+        member.recent.append(time.time())
+        return member
+
+    def acquire(self) -> PooledClient:
+        return self.claim(self.pick())
+
+    def release(self, member: PooledClient, error: Exception | None = None):
+        member.outstanding -= 1
+        if error is None:
+            member.consecutive_throttles = 0
+            return
+        member.errors += 1
+        if is_quota_error(error):
+            member.throttled += 1
+            member.consecutive_throttles += 1
+            cooldown = min(self.eject_seconds * 2 ** (member.consecutive_throttles - 1), 600)
+            member.ejected_until = time.time() + cooldown
+            print(f"UYARI: {member.label} anahtarı kota sınırına takıldı, {cooldown:.0f} sn havuz dışı.")
+
+    def stats(self) -> list[dict]:
+        now = time.time()
+        return [
+            {
+                "key": m.label,
+                "outstanding": m.outstanding,
+                "requests": m.requests,
+                "requests_last_minute": m.requests_last_minute(now),
+                "errors": m.errors,
+                "throttled": m.throttled,
+                "ejected_for_seconds": max(0, round(m.ejected_until - now, 1)),
+            }
+            for m in self.members
+        ]
+
+
+def is_quota_error(error: Exception) -> bool:
+    return isinstance(error, errors.APIError) and error.code == 429
+
+
+client_pool = ClientPool(api_keys, GEMINI_EJECT_SECONDS)
+
+
+async def _call_model(prompt, model: str, config: types.GenerateContentConfig | None):
+    """
+    Tek bir modele yapılan çağrı. Havuzdan bir anahtar seçer;
+    429 alırsa sıradaki anahtarla tekrar dener.
+    """
+    last_error = None
+    for _ in range(len(client_pool.members)):
+        member = client_pool.acquire()
+        error = None
+        try:
+            return await member.client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=config,
+            )
+        except Exception as e:
+            error = e
+            if not is_quota_error(e):
+                raise
+            last_error = e
+        finally:
+            # Zaman aşımı/iptal (CancelledError) dahil her durumda anahtar serbest bırakılır
+            client_pool.release(member, error)
+    raise last_error
+
+# ---------------------------------------------------------
+# MODEL YÖNLENDİRME (Endpoint ve isteğe göre model seçimi)
+# ---------------------------------------------------------
+
+def select_models(endpoint: str, diet_info: str = "") -> list[str]:
+    """
+    İstek için denenecek modelleri öncelik sırasıyla döndürür.
+    Diyet kısıtlaması olan istekler tam modele, şefin menüsü ve
+    isimden basit tarifler hafif modele gider. Diğer model yedek olarak kalır.
+    """
+    if parse_diet(diet_info):
+        primary = GEMINI_FULL_MODEL
+    elif endpoint in ("chef_menu", "recipe_by_name"):
+        primary = GEMINI_LIGHT_MODEL
+    else:
+        primary = GEMINI_FULL_MODEL
+    return [primary] + [m for m in (GEMINI_FULL_MODEL, GEMINI_LIGHT_MODEL) if m != primary]
+
+
+class ModelStats:
+    """Model başına çağrı sayıları ve gecikme dağılımı."""
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.quota_errors = 0
+        self.latencies = deque(maxlen=1000)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(p: float):
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3)
+
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "quota_errors": self.quota_errors,
+            "p50_seconds": percentile(0.50),
+            "p95_seconds": percentile(0.95),
+        }
+
+
+model_stats: defaultdict[str, ModelStats] = defaultdict(ModelStats)
+fallback_count = 0
+
+
+async def call_gemini(
+    prompt,
+    models: list[str] | None = None,
+    config: types.GenerateContentConfig | None = None,
+    endpoint: str = "diger",
+):
+    """
+    Tüm Gemini çağrılarının geçtiği ortak yardımcı.
+    İstemcinin günlük token bütçesi dolmuşsa hiç çağrı yapmadan 429 döner;
+    değilse isteğin önceliğine göre zamanlayıcıdan sıra bekler.
+    """
+    client_id = current_client_id.get()
+    token_ledger.check_budget(client_id)
+    async with upstream_scheduler.slot(current_priority.get()):
+        return await _call_with_fallback(prompt, models or [GEMINI_FULL_MODEL], config, endpoint, client_id)
+
+
+async def _call_with_fallback(prompt, models: list[str], config, endpoint: str, client_id: str):
+    """Modelleri sırayla dener: zaman aşımı veya kota hatasında bir sonraki modele geçer."""
+    global fallback_count
+    for index, model in enumerate(models):
+        timeout = UPSTREAM_TIMEOUT_SECONDS
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise HTTPException(status_code=504, detail="İstek süresi doldu")
+            timeout = min(timeout, remaining)
+        stats = model_stats[model]
+        stats.calls += 1
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(_call_model(prompt, model, config), timeout=timeout)
+        except asyncio.CancelledError:
+            record_cancelled_upstream(endpoint)
+            raise
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            if timeout < UPSTREAM_TIMEOUT_SECONDS:
+                # İsteğin kendi süresi doldu; başka modele geçmenin anlamı yok
+                raise HTTPException(status_code=504, detail="İstek süresi doldu")
+            error = TimeoutError(f"{model} {timeout:g} sn içinde cevap vermedi")
+        except Exception as e:
+            stats.failures += 1
+            if not is_quota_error(e):
+                raise
+            stats.quota_errors += 1
+            error = e
+        else:
+            stats.latencies.append(time.perf_counter() - started)
+            token_ledger.record(endpoint, model, client_id, response.usage_metadata)
+            return response
+
+        if index == len(models) - 1:
+            raise error
+        fallback_count += 1
+        print(f"UYARI: {model} başarısız ({error}), {models[index + 1]} modeline geçiliyor.")
+
+
+# ---------------------------------------------------------
+# TOKEN MUHASEBESİ VE GÜNLÜK BÜTÇELER
+# ---------------------------------------------------------
+
+# İsteği yapan istemci (X-Client-Id başlığı); middleware tarafından her istekte ayarlanır
+current_client_id: ContextVar[str] = ContextVar("current_client_id", default="anonim")
+
+
+def parse_named_ints(text: str) -> dict[str, int]:
+    """'mobil:200000,web:500000' biçimindeki ayarları sözlüğe çevirir."""
+    values = {}
+    for item in text.split(","):
+        name, _, value = item.partition(":")
+        if name.strip() and value.strip():
+            values[name.strip()] = int(value)
+    return values
+
+
+class TokenLedger:
+    """
+    usage_metadata'dan gelen token sayılarını endpoint, model ve istemci bazında
+    bellekte toplar; belirli aralıklarla günlük toplamlar olarak SQLite'a yazar.
+    Bütçe kontrolü, tüm worker'ların son yazılan toplamı + bu worker'ın
+    henüz yazılmamış kısmı üzerinden yapılır.
+    """
+
+    def __init__(self, path: str, daily_budget: int, client_budgets: dict[str, int]):
+        self.path = path
+        self.daily_budget = daily_budget
+        self.client_budgets = client_budgets
+        self.totals = {"endpoint": defaultdict(Counter), "model": defaultdict(Counter), "client": defaultdict(Counter)}
+        self._pending: defaultdict[tuple, Counter] = defaultdict(Counter)
+        self._flushed_today: dict[str, int] = {}
+        self._flushed_day = self.today()
+        self._flush_task: asyncio.Task | None = None
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS token_usage ("
+            " day TEXT NOT NULL,"
+            " client_id TEXT NOT NULL,"
+            " endpoint TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " calls INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " candidate_tokens INTEGER NOT NULL,"
+            " PRIMARY KEY (day, client_id, endpoint, model))"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def today() -> str:
+        return time.strftime("%Y-%m-%d", time.gmtime())
+
+    def budget_for(self, client_id: str) -> int:
+        return self.client_budgets.get(client_id, self.daily_budget)
+
+    def spent_today(self, client_id: str) -> int:
+        day = self.today()
+        pending = sum(
+            c["prompt_tokens"] + c["candidate_tokens"]
+            for (d, cid, _, _), c in self._pending.items()
+            if d == day and cid == client_id
+        )
+        flushed = self._flushed_today.get(client_id, 0) if self._flushed_day == day else 0
+        return flushed + pending
+
+    def check_budget(self, client_id: str):
+        budget = self.budget_for(client_id)
+        if budget and self.spent_today(client_id) >= budget:
+            raise HTTPException(status_code=429, detail="Günlük token bütçesi aşıldı, yarın tekrar deneyin.")
+
+    def record(self, endpoint: str, model: str, client_id: str, usage):
+        if usage is None:
+            return
+        counts = Counter(
+            calls=1,
+            prompt_tokens=usage.prompt_token_count or 0,
+            candidate_tokens=usage.candidates_token_count or 0,
+        )
+        for dimension, name in (("endpoint", endpoint), ("model", model), ("client", client_id)):
+            self.totals[dimension][name].update(counts)
+        self._pending[(self.today(), client_id, endpoint, model)].update(counts)
+
+    def _flush(self, pending: dict[tuple, Counter]):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO token_usage VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(day, client_id, endpoint, model) DO UPDATE SET "
+                " calls = calls + excluded.calls,"
+                " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                " candidate_tokens = candidate_tokens + excluded.candidate_tokens",
+                [
+                    (*key, c["calls"], c["prompt_tokens"], c["candidate_tokens"])
+                    for key, c in pending.items()
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return dict(conn.execute(
+            "SELECT client_id, SUM(prompt_tokens + candidate_tokens) FROM token_usage "
+            "WHERE day = ? GROUP BY client_id",
+            (self.today(),),
+        ).fetchall())
+
+    async def flush(self):
+        pending, self._pending = self._pending, defaultdict(Counter)
+        try:
+            day = self.today()
+            self._flushed_today = await asyncio.to_thread(self._flush, pending)
+            self._flushed_day = day
+        except Exception as e:
+            print(f"HATA (Token kaydı): {e}")
+            for key, counts in pending.items():
+                self._pending[key].update(counts)
+
+    def daily_report(self, day: str) -> list[dict]:
+        rows = self._conn().execute(
+            "SELECT client_id, endpoint, model, calls, prompt_tokens, candidate_tokens "
+            "FROM token_usage WHERE day = ? ORDER BY client_id, endpoint, model",
+            (day,),
+        ).fetchall()
+        columns = ("client_id", "endpoint", "model", "calls", "prompt_tokens", "candidate_tokens")
+        return [dict(zip(columns, row)) for row in rows]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(TOKEN_FLUSH_SECONDS)
+            await self.flush()
+
+    def start(self):
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+token_ledger = TokenLedger(USAGE_PATH, TOKEN_DAILY_BUDGET, parse_named_ints(TOKEN_CLIENT_BUDGETS))
+
+
+# ---------------------------------------------------------
+# ÖNCELİKLİ ZAMANLAYICI (interactive / batch / background)
+# ---------------------------------------------------------
+
+# Çağrının önceliği; HTTP istekleri interactive, arka plan işleri batch,
+# ön ısıtma ve tahmini yüklemeler background olarak işaretlenir
+current_priority: ContextVar[str] = ContextVar("current_priority", default="interactive")
+
+PRIORITIES = ("interactive", "batch", "background")
+
+
+class UpstreamScheduler:
+    """
+    Gemini'ye aynı anda yapılan çağrı sayısını sınırlar ve bekleyenleri
+    öncelik kuyruklarından ağırlıklı (smooth weighted round-robin) sırayla çıkarır.
+    Kapasitenin bir kısmı sadece interactive çağrılara ayrılmıştır; böylece
+    arka plan işleri boş kapasiteyi kullanır ama kullanıcıyı bekletmez.
+    """
+
+    def __init__(self, capacity: int, reserved_interactive: int, weights: dict[str, int], shared=None):
+        self.capacity = capacity
+        # Process içi sınır sadece bu worker'ı görür; shared verilirse diğer process'lerle de paylaşılır
+        self.shared = shared
+        self.reserved_interactive = min(reserved_interactive, capacity - 1)
+        self.weights = {p: max(1, weights.get(p, 1)) for p in PRIORITIES}
+        self.queues: dict[str, deque[asyncio.Future]] = {p: deque() for p in PRIORITIES}
+        self.active = Counter()
+        self.dispatched = Counter()
+        self.wait_seconds = Counter()
+        self._current = Counter()
+
+    def _total_active(self) -> int:
+        return sum(self.active.values())
+
+    def _can_start(self, priority: str) -> bool:
+        total = self._total_active()
+        if total >= self.capacity:
+            return False
+        if priority == "interactive":
+            return True
+        return total - self.active["interactive"] < self.capacity - self.reserved_interactive
+
+    def _dispatch(self):
+        while True:
+            eligible = [p for p in PRIORITIES if self.queues[p] and self._can_start(p)]
+            if not eligible:
+                return
+            for p in eligible:
+                self._current[p] += self.weights[p]
+            chosen = max(eligible, key=lambda p: self._current[p])
+            self._current[chosen] -= sum(self.weights[p] for p in eligible)
+            future = self.queues[chosen].popleft()
+            if not future.done():
+                self.active[chosen] += 1
+                future.set_result(None)
+
+    def _release(self, priority: str):
+        self.active[priority] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        if priority not in self.queues:
+            priority = "interactive"
+        started = time.perf_counter()
+        if self._can_start(priority) and not any(self.queues.values()):
+            self.active[priority] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.queues[priority].append(future)
+            self._dispatch()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Sıra tam iptal anında geldiyse slotu geri ver
+                    self._release(priority)
+                elif future in self.queues[priority]:
+                    self.queues[priority].remove(future)
+                raise
+        try:
+            lease = await self.shared.acquire(priority) if self.shared is not None else None
+        except BaseException:
+            self._release(priority)
+            raise
+        self.dispatched[priority] += 1
+        self.wait_seconds[priority] += time.perf_counter() - started
+        try:
+            yield
+        finally:
+            self._release(priority)
+            if lease is not None:
+                await self.shared.release(lease)
+
+    def stats(self) -> dict:
+        return {
+            p: {
+                "active": self.active[p],
+                "queued": len(self.queues[p]),
+                "dispatched": self.dispatched[p],
+                "avg_wait_seconds": round(self.wait_seconds[p] / self.dispatched[p], 3) if self.dispatched[p] else None,
+            }
+            for p in PRIORITIES
+        }
+
+    def is_idle(self, priority: str = "background") -> bool:
+        return not any(self.queues.values()) and self._can_start(priority)
+
+
+class SharedUpstreamSlots:
+    """
+    Aynı makinedeki tüm process'lerin (uvicorn worker'ları, pregenerate.py) devam eden
+    Gemini çağrılarını ortak bir SQLite tablosunda tutar. Interactive çağrılar hiç
+    bekletilmez, sadece sayılır; batch/background çağrılar makine genelinde toplam
+    kapasite ve interactive'e ayrılan pay doluysa boşalana kadar bekler. Böylece
+    ayrı bir process'teki ön ısıtma, sunucunun kullanıcı isteklerine ayrılan kapasitesini yemez.
+    Çöken process'in kayıtları lease_seconds sonra kendiliğinden düşer.
+    """
+
+    def __init__(self, path: str, capacity: int, reserved_interactive: int, lease_seconds: float):
+        self.path = path
+        self.capacity = capacity
+        self.reserved_interactive = min(reserved_interactive, capacity - 1)
+        self.lease_seconds = lease_seconds
+        self.stats = Counter()
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS upstream_slots ("
+            " id TEXT PRIMARY KEY,"
+            " priority TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Kayıtlar kısa ömürlü ve lease ile kendiliğinden düşüyor: her commit'te fsync gerekmez
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _try_acquire(self, priority: str) -> str | None:
+        conn = self._conn()
+        lease = uuid.uuid4().hex
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM upstream_slots WHERE expires_at <= ?", (now,))
+            if priority != "interactive":
+                total, interactive = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(priority = 'interactive'), 0) FROM upstream_slots"
+                ).fetchone()
+                if total >= self.capacity or total - interactive >= self.capacity - self.reserved_interactive:
+                    conn.execute("COMMIT")
+                    return None
+            conn.execute(
+                "INSERT INTO upstream_slots (id, priority, expires_at) VALUES (?, ?, ?)",
+                (lease, priority, now + self.lease_seconds),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return lease
+
+    def _release(self, lease: str):
+        self._conn().execute("DELETE FROM upstream_slots WHERE id = ?", (lease,))
+
+    async def acquire(self, priority: str) -> str | None:
+        waited = False
+        while True:
+            try:
+                lease = await asyncio.to_thread(self._try_acquire, priority)
+            except sqlite3.OperationalError as e:
+                if priority != "interactive":
+                    raise
+                # Interactive çağrı zaten bekletilmiyor, sadece sayılıyor: kilitli/bozuk dosya
+                # kullanıcı isteğini düşürmesin, kayıt atlanıp çağrıya devam edilir
+                self.stats["unrecorded"] += 1
+                print(f"HATA (Ortak slot kaydı): {e}")
+                return None
+            if lease is not None:
+                self.stats["waited" if waited else "immediate"] += 1
+                return lease
+            waited = True
+            await asyncio.sleep(UPSTREAM_SHARED_POLL_SECONDS)
+
+    async def release(self, lease: str):
+        try:
+            await asyncio.to_thread(self._release, lease)
+        except sqlite3.OperationalError as e:
+            # Silinemeyen kayıt lease_seconds sonra kendiliğinden düşer
+            self.stats["release_failed"] += 1
+            print(f"HATA (Ortak slot bırakma): {e}")
+
+    def snapshot(self) -> dict:
+        rows = self._conn().execute(
+            "SELECT priority, COUNT(*) FROM upstream_slots WHERE expires_at > ? GROUP BY priority", (time.time(),)
+        ).fetchall()
+        return {"capacity": self.capacity, "active": dict(rows), **dict(self.stats)}
+
+
+shared_upstream_slots = SharedUpstreamSlots(
+    UPSTREAM_SHARED_PATH, UPSTREAM_SHARED_CAPACITY, UPSTREAM_RESERVED_INTERACTIVE,
+    # Bir slot en fazla tüm modellerin zaman aşımı kadar tutulur; çöken process'in kaydı bundan sonra düşer
+    lease_seconds=UPSTREAM_TIMEOUT_SECONDS * 3,
+) if UPSTREAM_SHARED_PATH else None
+
+upstream_scheduler = UpstreamScheduler(
+    UPSTREAM_CONCURRENCY, UPSTREAM_RESERVED_INTERACTIVE, parse_named_ints(SCHEDULER_WEIGHTS), shared_upstream_slots
+)
+
+
+# ---------------------------------------------------------
+# İPTAL: İstemci bağlantıyı kapatınca veya süre dolunca
+# ---------------------------------------------------------
+
+# İsteğin bitmesi gereken an (time.monotonic() cinsinden); yoksa None
+current_deadline: ContextVar[float | None] = ContextVar("current_deadline", default=None)
+
+cancellation_stats = Counter()
+
+
+def parse_deadline(headers) -> float | None:
+    """
+    X-Request-Timeout: 10        -> şu andan itibaren 10 saniye
+    X-Request-Deadline: <epoch>  -> mutlak zaman (Unix saniyesi)
+    """
+    try:
+        if headers.get("x-request-timeout"):
+            return time.monotonic() + float(headers["x-request-timeout"])
+        if headers.get("x-request-deadline"):
+            return time.monotonic() + (float(headers["x-request-deadline"]) - time.time())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Geçersiz X-Request-Timeout / X-Request-Deadline")
+    return None
+
+
+def remaining_time() -> float | None:
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def record_cancelled_upstream(endpoint: str):
+    """İptal edilen Gemini çağrısı: bu endpoint'in ortalama çıktı token'ı kadar tasarruf sayılır."""
+    cancellation_stats["upstream_cancelled"] += 1
+    usage = token_ledger.totals["endpoint"].get(endpoint)
+    if usage and usage["calls"]:
+        cancellation_stats["estimated_tokens_saved"] += usage["candidate_tokens"] // usage["calls"]
+
+
+async def run_while_connected(http_request: Request, coro):
+    """
+    Üretimi çalıştırırken istemcinin bağlantısını ve isteğin süresini izler.
+    İstemci giderse ya da süre dolarsa beklemeyi bırakır; aynı sonucu bekleyen
+    başka istek yoksa arkadaki Gemini çağrısı da iptal edilir (bkz. get_or_load).
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            timeout = DISCONNECT_POLL_SECONDS
+            remaining = remaining_time()
+            if remaining is not None:
+                timeout = max(0, min(timeout, remaining))
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+            if done:
+                return task.result()
+            if remaining is not None and remaining <= timeout:
+                cancellation_stats["deadline_exceeded"] += 1
+                raise HTTPException(status_code=504, detail="İstek süresi doldu")
+            if await http_request.is_disconnected():
+                cancellation_stats["client_disconnects"] += 1
+                # 499: istemci isteği kapattı (cevap zaten okunmayacak)
+                raise HTTPException(status_code=499, detail="İstemci bağlantıyı kapattı")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
+# ---------------------------------------------------------
+# CEVAP SIKIŞTIRMA VE ETAG
+# ---------------------------------------------------------
+
+class EncodedPayload:
+    """
+    Bir JSON cevabının ham byte'ları, içerik hash'i ve sıkıştırılmış halleri.
+    Sıkıştırma her kodlama için bir kez yapılır, sonraki isteklerde hazır byte'lar gönderilir.
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()[:32]
+        self._variants: dict[str, bytes] = {}
+
+    def etag(self, encoding: str) -> str:
+        # Strong ETag: kodlama başına farklı byte'lar olduğu için kodlama da etikete eklenir
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding == "identity":
+            return self.body
+        data = self._variants.get(encoding)
+        if data is None:
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=5)
+            else:
+                data = gzip.compress(self.body, compresslevel=6)
+            self._variants[encoding] = data
+        return data
+
+
+# İçerik hash'ine göre hazır (sıkıştırılmış) cevaplar, process içi LRU
+encoded_payloads: OrderedDict[str, EncodedPayload] = OrderedDict()
+
+
+def get_encoded_payload(data) -> EncodedPayload:
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    payload = encoded_payloads.get(digest)
+    if payload is None:
+        payload = EncodedPayload(body)
+        encoded_payloads[digest] = payload
+        while len(encoded_payloads) > ENCODED_CACHE_MAX_ENTRIES:
+            encoded_payloads.popitem(last=False)
+    else:
+        encoded_payloads.move_to_end(digest)
+    return payload
+
+
+def negotiate_encoding(accept_encoding: str, size: int) -> str:
+    """Accept-Encoding başlığına göre br > gzip > identity sırasıyla kodlama seçer."""
+    if size < COMPRESSION_MIN_BYTES:
+        return "identity"
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best, best_quality = "identity", 0.0
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def etag_matches(if_none_match: str, payload: EncodedPayload) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        if tag.split("-")[0] == payload.digest:
+            return True
+    return False
+
+
+def encoded_response(request: Request, data, cache_control: str | None = None) -> Response:
+    """
+    Veriyi JSON cevabına çevirir: istemci destekliyorsa sıkıştırır,
+    If-None-Match aynı içeriği gösteriyorsa gövdesiz 304 döner.
+    """
+    payload = get_encoded_payload(data)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), len(payload.body))
+    headers = {"ETag": payload.etag(encoding), "Vary": "Accept-Encoding"}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if etag_matches(request.headers.get("if-none-match", ""), payload):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(payload.encoded(encoding), media_type="application/json", headers=headers)
+
+
+# ---------------------------------------------------------
+# ARKA PLAN İŞLERİ (202 Accepted + sorgulama / webhook)
+# ---------------------------------------------------------
+
+class JobStore:
+    """
+    Uzun süren üretimler için kalıcı iş tablosu. Tüm worker process'ler aynı
+    dosyayı kullanır; bir işi sadece onu atomik olarak 'running' yapan worker çalıştırır.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " result TEXT,"
+            " error TEXT,"
+            " callback_url TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, kind: str, payload: dict, callback_url: str | None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, payload, status, callback_url, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), callback_url, now, now),
+        )
+        return job_id
+
+    def claim(self, job_id: str) -> bool:
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def finish(self, job_id: str, result=None, error: str | None = None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (
+                "failed" if error else "done",
+                None if error else json.dumps(result, ensure_ascii=False),
+                error,
+                time.time(),
+                job_id,
+            ),
+        )
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT id, kind, payload, status, result, error, callback_url, created_at, updated_at "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "payload": json.loads(row[2]),
+            "status": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "callback_url": row[6],
+            "created_at": row[7],
+            "updated_at": row[8],
+        }
+
+    def recoverable(self, stale_after: float) -> list[str]:
+        """Kuyrukta bekleyen ve (çöken bir worker'dan kalan) takılmış işleri döndürür."""
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+            (time.time() - stale_after,),
+        )
+        return [row[0] for row in conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at")]
+
+
+class JobRunner:
+    """Sınırlı sayıda arka plan görevinden oluşan iş havuzu."""
+
+    def __init__(self, store: JobStore, workers: int):
+        self.store = store
+        self.workers = workers
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._done_events: dict[str, asyncio.Event] = {}
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        for job_id in await asyncio.to_thread(self.store.recoverable, JOB_STALE_SECONDS):
+            self._queue.put_nowait(job_id)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, kind: str, payload: dict, callback_url: str | None) -> str:
+        job_id = await asyncio.to_thread(self.store.create, kind, payload, callback_url)
+        self._done_events[job_id] = asyncio.Event()
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    async def wait(self, job_id: str, timeout: float) -> dict | None:
+        """Long-polling: iş bitene ya da süre dolana kadar bekler, son durumu döndürür."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await asyncio.to_thread(self.store.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+                return job
+            # İş bu worker'daysa olayı bekle, başka worker'daysa tabloyu aralıklarla kontrol et
+            event = self._done_events.get(job_id)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), timeout=remaining)
+                else:
+                    await asyncio.sleep(min(0.5, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                if await asyncio.to_thread(self.store.claim, job_id):
+                    await self._run(job_id)
+            except Exception as e:
+                print(f"HATA (İş {job_id}): {e}")
+            finally:
+                event = self._done_events.pop(job_id, None)
+                if event is not None:
+                    event.set()
+
+    async def _run(self, job_id: str):
+        job = await asyncio.to_thread(self.store.get, job_id)
+        current_client_id.set(job["payload"].get("client_id", "anonim"))
+        current_priority.set("batch")
+        try:
+            result = await JOB_HANDLERS[job["kind"]](job["payload"])
+        except HTTPException as e:
+            await asyncio.to_thread(self.store.finish, job_id, error=str(e.detail))
+        except Exception as e:
+            await asyncio.to_thread(self.store.finish, job_id, error=str(e))
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, result)
+        if job["callback_url"]:
+            await self._notify(await asyncio.to_thread(self.store.get, job_id))
+
+    async def _notify(self, job: dict):
+        body = {k: job[k] for k in ("id", "status", "result", "error")}
+        # Kayıt ile gönderim arasında DNS değişmiş olabilir: hedef tekrar doğrulanır
+        if not await asyncio.to_thread(callback_url_allowed, job["callback_url"]):
+            print(f"HATA (Webhook {job['id']}): izin verilmeyen hedef")
+            return
+        try:
+            async with httpx.AsyncClient(timeout=10, follow_redirects=False) as http:
+                await http.post(job["callback_url"], json=body)
+        except Exception as e:
+            print(f"HATA (Webhook {job['id']}): {e}")
+
+
+JOB_HANDLERS = {
+    "recipe": lambda p: recipe_from_ingredients(p["ingredients"], p["kategori"], p["diet_info"], p.get("fields")),
+    "recipe_by_name": lambda p: recipe_from_dish_name(p["dish_name"], p["diet_info"], p.get("fields")),
+}
+
+job_runner = JobRunner(JobStore(JOBS_PATH), JOB_WORKERS)
+
+
+def callback_url_allowed(url: str) -> bool:
+    """
+    Webhook hedefi sunucunun iç ağına yönelmemeli (SSRF): host'un çözüldüğü tüm
+    adresler genel internette olmalı. JOB_CALLBACK_HOSTS'taki hostlar bu kontrolden muaftır.
+    """
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    host = parsed.hostname.lower()
+    if host in JOB_CALLBACK_HOSTS:
+        return True
+    try:
+        infos = socket.getaddrinfo(host, parsed.port or (443 if parsed.scheme == "https" else 80), proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError, ValueError):
+        return False
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            return False
+    return bool(infos)
+
+
+def wants_async(http_request: Request) -> bool:
+    """İstemci 'Prefer: respond-async' başlığı ya da ?mode=async ile iş modu isteyebilir."""
+    prefer = http_request.headers.get("prefer", "").lower()
+    return "respond-async" in prefer or http_request.query_params.get("mode") == "async"
+
+
+async def submit_job(http_request: Request, kind: str, payload: dict) -> JSONResponse:
+    callback_url = http_request.headers.get("x-callback-url")
+    if callback_url and not await asyncio.to_thread(callback_url_allowed, callback_url):
+        raise HTTPException(status_code=400, detail="Geçersiz X-Callback-URL")
+    payload = {**payload, "client_id": current_client_id.get()}
+    job_id = await job_runner.submit(kind, payload, callback_url)
+    status_url = f"/api/jobs/{job_id}"
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "status_url": status_url},
+        headers={"Location": status_url},
+    )
+
+
+# ---------------------------------------------------------
+# WEBSOCKET TARİF DÜZENLEME OTURUMLARI (Gemini chat bağlamı)
+# ---------------------------------------------------------
+
+_json_decoder = json.JSONDecoder()
+
+def parse_partial_object(text: str) -> dict:
+    """
+    Akış halinde gelen (yarım) bir JSON nesnesinin tamamlanmış üst düzey
+    alanlarını döndürür. Böylece her alan hazır olur olmaz istemciye gönderilebilir.
+    """
+    fields = {}
+    i = text.find("{")
+    if i < 0:
+        return fields
+    i += 1
+    n = len(text)
+    while True:
+        while i < n and text[i] in " \t\r\n,":
+            i += 1
+        if i >= n or text[i] == "}":
+            return fields
+        try:
+            key, i = _json_decoder.raw_decode(text, i)
+            while i < n and text[i] in " \t\r\n":
+                i += 1
+            if i >= n or text[i] != ":":
+                return fields
+            i += 1
+            while i < n and text[i] in " \t\r\n":
+                i += 1
+            value, i = _json_decoder.raw_decode(text, i)
+        except json.JSONDecodeError:
+            return fields
+        if i >= n and isinstance(value, (int, float)):
+            # Sayı metnin sonundaysa henüz tamamlanmamış olabilir
+            return fields
+        fields[key] = value
+
+
+class RefinementSession:
+    """Bir kullanıcının düzenleme oturumu: Gemini chat nesnesi + tarifin son hali."""
+
+    def __init__(self, member: PooledClient, dish_name: str, diet_info: str, recipe: dict):
+        self.member = member
+        self.dish_name = dish_name
+        self.diet_info = diet_info
+        self.recipe = recipe
+        self.turns = 0
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.chat = self._new_chat()
+
+    def _new_chat(self):
+        # Geçmiş, sadece ilk istek + tarifin güncel halinden oluşur; önceki adımlar taşınmaz
+        history = [
+            types.Content(role="user", parts=[types.Part(text=build_dish_prompt(self.dish_name, self.diet_info))]),
+            types.Content(role="model", parts=[types.Part(text=json.dumps(self.recipe, ensure_ascii=False))]),
+        ]
+        return self.member.client.aio.chats.create(
+            model=GEMINI_FULL_MODEL,
+            history=history,
+            config=types.GenerateContentConfig(response_mime_type="application/json"),
+        )
+
+    async def refine(self, instruction: str):
+        """
+        Sadece değişiklik talimatını gönderir, değişen alanları hazır oldukça yield eder.
+        Bitince tarifin güncel halini self.recipe içinde tutar.
+        """
+        if self.turns >= WS_MAX_TURNS:
+            # Geçmiş büyümesin diye sohbeti tarifin son haliyle yeniden başlat
+            self.chat = self._new_chat()
+            self.turns = 0
+        message = (
+            f"Tarifi şu isteğe göre güncelle: {instruction}. "
+            "SADECE değişen alanları aynı JSON anahtarlarıyla döndür, değişmeyen alanları yazma."
+        )
+        client_id = current_client_id.get()
+        token_ledger.check_budget(client_id)
+        buffer = ""
+        sent: dict = {}
+        usage = None
+        async with upstream_scheduler.slot("interactive"):
+            client_pool.claim(self.member)
+            error = None
+            # Akış takılırsa slot ve oturum kilidi sonsuza dek tutulmasın: tüm akış için tek süre sınırı
+            deadline = time.monotonic() + UPSTREAM_TIMEOUT_SECONDS
+            stream = None
+            try:
+                stream = await asyncio.wait_for(self.chat.send_message_stream(message), UPSTREAM_TIMEOUT_SECONDS)
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(stream), max(0.0, deadline - time.monotonic()))
+                    except StopAsyncIteration:
+                        break
+                    buffer += chunk.text or ""
+                    usage = chunk.usage_metadata or usage
+                    for field, value in parse_partial_object(buffer).items():
+                        if field not in sent:
+                            sent[field] = value
+                            yield field, value
+            except asyncio.TimeoutError:
+                model_stats[GEMINI_FULL_MODEL].timeouts += 1
+                error = TimeoutError(f"{GEMINI_FULL_MODEL} {UPSTREAM_TIMEOUT_SECONDS:g} sn içinde cevap vermedi")
+                raise error from None
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if stream is not None and hasattr(stream, "aclose"):
+                    await stream.aclose()
+                client_pool.release(self.member, error)
+        token_ledger.record("refine", GEMINI_FULL_MODEL, client_id, usage)
+        try:
+            changes = json.loads(clean_json_response(buffer))
+        except json.JSONDecodeError:
+            changes = sent
+        for field, value in changes.items():
+            if field not in sent:
+                yield field, value
+        self.recipe.update({k: v for k, v in changes.items() if k in RECIPE_FIELDS})
+        if "malzemeler" in changes:
+            # Malzemeler değiştiyse kalori yerelde yeniden hesaplanır
+            kalori = with_nutrition(self.recipe)["kalori"]
+            if kalori != self.recipe.get("kalori"):
+                self.recipe["kalori"] = kalori
+                yield "kalori", kalori
+        self.turns += 1
+        self.last_used = time.monotonic()
+
+
+class RefinementSessions:
+    """
+    Kullanıcı başına oturumlar. Boşta kalan oturumlar WS_SESSION_IDLE_SECONDS
+    sonra, toplam sayı WS_MAX_SESSIONS'ı aşınca da en eski kullanılan atılır.
+    """
+
+    def __init__(self, max_sessions: int, idle_seconds: float):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions: OrderedDict[str, RefinementSession] = OrderedDict()
+        self.evicted = 0
+
+    def get(self, client_id: str) -> RefinementSession | None:
+        self.evict_idle()
+        session = self._sessions.get(client_id)
+        if session is not None:
+            self._sessions.move_to_end(client_id)
+        return session
+
+    def put(self, client_id: str, session: RefinementSession):
+        self._sessions[client_id] = session
+        self._sessions.move_to_end(client_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for client_id in [cid for cid, s in self._sessions.items() if s.last_used < cutoff]:
+            del self._sessions[client_id]
+            self.evicted += 1
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+refinement_sessions = RefinementSessions(WS_MAX_SESSIONS, WS_SESSION_IDLE_SECONDS)
+
+
+# ---------------------------------------------------------
+# EKSİK / HATALI ALAN ONARIMI (Kısmi yeniden sorma)
+# ---------------------------------------------------------
+
+repair_stats = Counter()
+
+
+def parse_model_json(text: str) -> dict:
+    """
+    Model cevabını sözlüğe çevirir. JSON bozuksa (örn. yarıda kesilmişse)
+    tamamlanmış alanlar kurtarılır; metin olarak gelen liste alanları bölünür.
+    """
+    cleaned = clean_json_response(text)
+    try:
+        data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        data = parse_partial_object(cleaned)
+    if isinstance(data, list) and data and isinstance(data[0], dict):
+        data = data[0]
+    if not isinstance(data, dict):
+        return {}
+    for field, expected in RECIPE_FIELDS.items():
+        if expected is list and isinstance(data.get(field), str):
+            data[field] = [item.strip() for item in data[field].replace("\n", ",").split(",") if item.strip()]
+    return data
+
+
+async def repair_recipe_fields(data: dict, alanlar: set[str] | None, models: list[str], endpoint: str) -> dict:
+    """
+    İstenen alanlardan eksik/hatalı olanları, tarifin geri kalanını bağlam olarak
+    verip sadece o alanları isteyerek tamamlar. Tam üretimi tekrarlamaktan çok daha ucuzdur.
+    """
+    wanted = alanlar or set(RECIPE_FIELDS)
+    invalid = [f for f in validate_recipe(data) if f in wanted]
+    if not invalid:
+        return data
+
+    for _ in range(REPAIR_MAX_ATTEMPTS):
+        repair_stats["attempts"] += 1
+        known = {k: v for k, v in data.items() if k in RECIPE_FIELDS and k not in invalid}
+        repair_prompt = (
+            f"Aşağıdaki tarifte şu alanlar eksik veya hatalı: {', '.join(invalid)}. "
+            f"Mevcut tarif: {json.dumps(known, ensure_ascii=False)} "
+            "Tarifle tutarlı olacak şekilde SADECE bu alanları aşağıdaki JSON formatında döndür:"
+            + recipe_schema(set(invalid))
+        )
+        response = await call_gemini(
+            repair_prompt,
+            models=models,
+            endpoint=f"{endpoint}_repair",
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                max_output_tokens=MAX_OUTPUT_TOKENS_COMPACT,
+            )
+        )
+        patch = parse_model_json(response.text)
+        data = {**data, **{k: v for k, v in patch.items() if k in invalid}}
+        invalid = [f for f in validate_recipe(data) if f in wanted]
+        if not invalid:
+            repair_stats["repaired"] += 1
+            return {**{f: data[f] for f in RECIPE_FIELDS if f in data}, **data}
+
+    repair_stats["failed"] += 1
+    raise ValueError(f"Model eksik/hatalı alan döndürdü: {', '.join(invalid)}")
+
+
+# ---------------------------------------------------------
+# NEGATİF ÖNBELLEK (Reddedilen / çözülemeyen üretimler)
+# ---------------------------------------------------------
+
+negative_stats = Counter()
+
+# Modelin "bu bir yemek değil" gibi durumlarda döneceği kısa cevap
+REFUSAL_INSTRUCTION = (
+    "Girdi yenilebilir bir yemek/malzeme değilse veya tarif oluşturulamıyorsa "
+    "SADECE {\"hata\": \"kısa sebep\"} döndür. "
+)
+
+BLOCKING_FINISH_REASONS = {"SAFETY", "PROHIBITED_CONTENT", "BLOCKLIST", "SPII"}
+
+
+class GenerationRejected(Exception):
+    """Model isteği reddetti (kind: refusal) ya da güvenlik filtresine takıldı (kind: safety)."""
+
+    def __init__(self, kind: str, reason: str):
+        super().__init__(reason)
+        self.kind = kind
+        self.reason = reason
+
+
+def blocked_reason(response) -> str | None:
+    """Cevap güvenlik filtresine takıldıysa sebebini döner."""
+    feedback = getattr(response, "prompt_feedback", None)
+    if feedback is not None and feedback.block_reason:
+        return str(getattr(feedback.block_reason, "value", feedback.block_reason))
+    for candidate in getattr(response, "candidates", None) or []:
+        reason = getattr(candidate.finish_reason, "value", candidate.finish_reason)
+        if reason in BLOCKING_FINISH_REASONS:
+            return reason
+    return None
+
+
+def parse_recipe_response(response) -> dict:
+    """Tarif cevabını çözer; ret ve güvenlik engellerini GenerationRejected olarak yükseltir."""
+    reason = blocked_reason(response)
+    if reason:
+        raise GenerationRejected("safety", f"İstek güvenlik filtresine takıldı ({reason})")
+    data = parse_model_json(response.text or "")
+    if data.get("hata"):
+        raise GenerationRejected("refusal", str(data["hata"]))
+    return data
+
+
+async def with_negative_cache(cache_key: str, load):
+    """
+    Aynı girdi kısa süre önce reddedildiyse (ya da art arda çözülemediyse)
+    Gemini'ye gitmeden hızlıca 422 döner. Anahtar pozitif önbellekle aynıdır.
+    """
+    negative_key = f"neg:{cache_key}"
+    try:
+        entry = await recipe_cache.get(negative_key)
+    except Exception as e:
+        print(f"HATA (Negatif önbellek okuma): {e}")
+        entry = None
+    if entry and entry.get("blocked"):
+        negative_stats["hits"] += 1
+        raise HTTPException(status_code=422, detail=entry["reason"])
+
+    try:
+        return await load()
+    except GenerationRejected as e:
+        negative_stats[f"stored_{e.kind}"] += 1
+        await remember_negative(negative_key, {"blocked": True, "kind": e.kind, "reason": e.reason})
+        raise HTTPException(status_code=422, detail=e.reason)
+    except ValueError as e:
+        # JSON/şema hataları geçici olabilir; ancak art arda tekrarlanırsa engellenir
+        failures = (entry or {}).get("failures", 0) + 1
+        negative_stats["parse_failures"] += 1
+        await remember_negative(negative_key, {
+            "blocked": failures >= NEGATIVE_PARSE_FAILURES,
+            "kind": "parse",
+            "reason": f"Bu istek için geçerli bir tarif üretilemedi: {e}",
+            "failures": failures,
+        })
+        raise
+
+
+async def remember_negative(negative_key: str, entry: dict):
+    try:
+        await recipe_cache.set(negative_key, entry, NEGATIVE_CACHE_TTL_SECONDS)
+    except Exception as e:
+        print(f"HATA (Negatif önbellek yazma): {e}")
+
+
+# ---------------------------------------------------------
+# MENÜ MOTORU (Depodaki tek tek yemeklerden menü oluşturma)
+# ---------------------------------------------------------
+
+MENU_COURSES = ("çorba", "ana yemek", "tatlı")
+
+# Depodaki isimden üretilmiş tarifleri menü havuzuna katmak için basit sınıflandırma
+DESSERT_KEYWORDS = (
+    "tatlı", "baklava", "sütlaç", "kek", "puding", "helva", "muhallebi", "kazandibi", "künefe", "revani",
+    "şöbiyet", "lokma", "tulumba", "kurabiye", "pasta", "dondurma", "aşure", "güllaç", "keşkül", "tiramisu",
+    "cheesecake", "profiterol", "supangle", "trileçe", "kadayıf", "komposto", "hoşaf",
+)
+
+# Yemekler arası malzeme çakışması hesaplanırken yok sayılan temel malzemeler
+STAPLE_INGREDIENTS = {
+    "tuz", "su", "sıvı yağ", "zeytinyağı", "tereyağı", "soğan", "sarımsak", "karabiber", "pul biber",
+    "toz biber", "domates salçası", "un", "toz şeker", "et suyu", "limon suyu",
+}
+
+# Aynı anda doldurulan aşamaların birbirini tamamlaması için ortak tema
+SEASON_THEMES = {
+    "kış": ("sıcak ve doyurucu Anadolu kış sofrası", "Karadeniz mutfağı", "fırın yemekleri ve kışlık tatlar"),
+    "ilkbahar": ("taze otlar ve bahar sebzeleri", "Ege zeytinyağlıları", "hafif ve renkli bahar sofrası"),
+    "yaz": ("serinletici Ege ve Akdeniz lezzetleri", "bahçe sebzeleriyle yaz sofrası", "hafif ızgara akşamı"),
+    "sonbahar": ("hasat sofrası: kabak, kestane ve ayva", "Güneydoğu mutfağı", "bağ bozumu ve baharatlı tatlar"),
+}
+
+menu_stats = Counter()
+
+
+def current_season(month: int | None = None) -> str:
+    month = month or time.localtime().tm_mon
+    return ("kış", "ilkbahar", "yaz", "sonbahar")[(month % 12) // 3]
+
+
+def classify_course(data: dict) -> str:
+    """Yemek adına göre menü aşaması; emin olunamazsa boş döner (menü havuzuna girmez)."""
+    name = normalize_text(str(data.get("yemekAdi", "")))
+    if "çorba" in name:
+        return "çorba"
+    if any(keyword in name for keyword in DESSERT_KEYWORDS):
+        return "tatlı"
+    return ""
+
+
+class MenuComposer:
+    """
+    Üç aşamalı menüleri depodaki yemeklerden oluşturur. Her aşama için mevsime uygun
+    adaylardan örneklem alınır, malzeme çakışması en az ve toplam kalorisi hedefe en yakın
+    kombinasyonlardan biri seçilir. İstemciye yakın zamanda sunulan yemekler tekrar edilmez.
+    Gemini sadece bir aşamanın havuzu azaldığında yeni yemeklerle doldurmak için çağrılır.
+    """
+
+    def __init__(self, store: RecipeStore):
+        self.store = store
+        # (aşama, mevsim) -> devam eden doldurma işi; aynı havuz iki kez doldurulmasın
+        self._topups: dict[tuple[str, str], asyncio.Task] = {}
+
+    async def compose(self, client_id: str | None = None) -> dict:
+        season, theme, served, since = await self._context(client_id)
+        # Üç aşamanın havuzu (gerekirse Gemini ile doldurma dahil) aynı anda hazırlanır
+        pools = await asyncio.gather(*(self._pool(k, season, theme, served) for k in MENU_COURSES))
+        chosen = self._choose(pools)
+        if client_id:
+            await self.store.record_served(client_id, [key for key, _ in chosen], since)
+        menu_stats["composed"] += 1
+        return {"menu": [data for _, data in chosen]}
+
+    async def compose_stream(self, client_id: str | None = None):
+        """
+        Aşamaları hazır oldukça (kategori, yemek) olarak yield eder; ilk yemek diğerlerini beklemez.
+        Her yemek, önceden seçilenlerle en iyi uyuşan adaylar arasından seçilir.
+        """
+        season, theme, served, since = await self._context(client_id)
+        tasks = {asyncio.create_task(self._pool(k, season, theme, served)): k for k in MENU_COURSES}
+        chosen = []
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    key, data = self._choose_next(task.result(), chosen)
+                    chosen.append((key, data))
+                    yield tasks[task], data
+        finally:
+            for task in tasks:
+                task.cancel()
+        if client_id:
+            await self.store.record_served(client_id, [key for key, _ in chosen], since)
+        menu_stats["composed"] += 1
+        menu_stats["streamed"] += 1
+
+    async def _context(self, client_id: str | None) -> tuple[str, str, list[str], float]:
+        season = current_season()
+        since = time.time() - MENU_NO_REPEAT_DAYS * 86400
+        served = await self.store.recently_served(client_id, since) if client_id else []
+        return season, random.choice(SEASON_THEMES[season]), served, since
+
+    async def _pool(self, kategori: str, season: str, theme: str, served: list[str]) -> list[tuple[str, dict]]:
+        candidates = await self.store.course_candidates(kategori, season, served, MENU_CANDIDATES)
+        if not candidates:
+            # Havuz boş ya da hepsi yakın zamanda sunulmuş: beklemek zorundayız
+            menu_stats["sync_topups"] += 1
+            await asyncio.shield(self._top_up_task(kategori, season, theme=theme))
+            candidates = await self.store.course_candidates(kategori, season, served, MENU_CANDIDATES)
+        if not candidates:
+            # Doldurma da yetmediyse tekrar yasağı gevşetilir
+            menu_stats["repeats_allowed"] += 1
+            candidates = await self.store.course_candidates(kategori, season, [], MENU_CANDIDATES)
+        if not candidates:
+            raise HTTPException(status_code=503, detail=f"Menü için {kategori} bulunamadı")
+        if await self.store.course_count(kategori, season) < MENU_COURSE_POOL_MIN:
+            self._top_up_task(kategori, season, "background", theme)
+        return candidates
+
+    @staticmethod
+    def _features(data: dict) -> tuple[set[str], int]:
+        malzemeler = data.get("malzemeler") if isinstance(data.get("malzemeler"), list) else []
+        return (
+            nutrition_engine.ingredient_names([str(m) for m in malzemeler]) - STAPLE_INGREDIENTS,
+            parse_kcal(data.get("kalori")) or 0,
+        )
+
+    def _choose(self, pools: list[list[tuple[str, dict]]]) -> list[tuple[str, dict]]:
+        """Tüm kombinasyonları puanlar, en iyi birkaç tanesinden birini rastgele seçer (çeşitlilik)."""
+        features = {key: self._features(data) for pool in pools for key, data in pool}
+        scored = []
+        for combo in product(*pools):
+            ingredients = [features[key][0] for key, _ in combo]
+            overlap = sum(len(a & b) for a, b in combinations(ingredients, 2))
+            kcal = sum(features[key][1] for key, _ in combo)
+            balance = abs(kcal - MENU_TARGET_KALORI) / MENU_TARGET_KALORI
+            scored.append((overlap + balance, combo))
+        scored.sort(key=lambda item: item[0])
+        return list(random.choice(scored[:3])[1])
+
+    def _choose_next(self, pool: list[tuple[str, dict]], chosen: list[tuple[str, dict]]) -> tuple[str, dict]:
+        """Akış modunda açgözlü seçim: önceki yemeklerle çakışma ve kalori payı (hedefin üçte biri)."""
+        previous = [self._features(data)[0] for _, data in chosen]
+        scored = []
+        for key, data in pool:
+            ingredients, kcal = self._features(data)
+            overlap = sum(len(ingredients & other) for other in previous)
+            balance = abs(kcal - MENU_TARGET_KALORI / len(MENU_COURSES)) / MENU_TARGET_KALORI
+            scored.append((overlap + balance, (key, data)))
+        scored.sort(key=lambda item: item[0])
+        return random.choice(scored[:3])[1]
+
+    def _top_up_task(self, kategori: str, season: str, priority: str | None = None, theme: str = "") -> asyncio.Task:
+        """Havuzu dolduran işi başlatır; aynı havuz için devam eden iş varsa onu döner."""
+        task = self._topups.get((kategori, season))
+        if task is None:
+            task = asyncio.create_task(self._top_up(kategori, season, priority, theme))
+            self._topups[(kategori, season)] = task
+        return task
+
+    async def _top_up(self, kategori: str, season: str, priority: str | None, theme: str):
+        # Havuz ortak; isteği başlatan istemcinin süre sınırı ve token bütçesi bu işe taşınmasın
+        if priority:
+            current_priority.set(priority)
+        current_client_id.set("menu")
+        current_deadline.set(None)
+        try:
+            await self._generate_courses(kategori, season, theme)
+        except Exception as e:
+            menu_stats["topup_errors"] += 1
+            print(f"HATA (Menü havuzu {kategori}/{season}): {e}")
+        finally:
+            del self._topups[(kategori, season)]
+
+    async def _generate_courses(self, kategori: str, season: str, theme: str = ""):
+        existing = await self.store.course_names(kategori, season)
+        prompt = (
+            f"Sen profesyonel bir şefsin. {season.capitalize()} mevsimine uygun, Türk mutfağından, "
+            f"birbirinden farklı {MENU_TOPUP_BATCH} adet {kategori} tarifi oluştur. "
+            + (f"Menünün teması: {theme}; tarifler bu temadaki diğer aşamalarla uyumlu olsun. " if theme else "")
+            + (f"Şunları tekrar etme: {', '.join(existing)}. " if existing else "")
+            + "Cevabı SADECE aşağıdaki JSON formatında döndür: {'tarifler': ["
+            + recipe_schema(generation_fields(None))
+            + ", ...]}"
+        )
+        models = select_models("chef_menu")
+        response = await call_gemini(
+            prompt,
+            models=models,
+            endpoint="chef_menu",
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                max_output_tokens=MAX_OUTPUT_TOKENS_MENU,
+            )
+        )
+        data = json.loads(clean_json_response(response.text))
+        courses = data.get("tarifler", []) if isinstance(data, dict) else data
+        rows = []
+        for course in courses:
+            try:
+                course = with_nutrition(await repair_recipe_fields(course, generation_fields(None), models, "chef_menu"))
+            except ValueError as e:
+                print(f"UYARI: Menü yemeği atlandı: {e}")
+                continue
+            name = normalize_text(course["yemekAdi"])
+            key = make_cache_key("menu_course", dish_name=name, kategori=kategori)
+            rows.append((key, name, "", course, kategori, season))
+        await self.store.put_many(rows, source="menu")
+        menu_stats["topups"] += 1
+        menu_stats["topup_courses"] += len(rows)
+
+
+menu_composer = MenuComposer(recipe_store)
+
+
+# ---------------------------------------------------------
+# DİYET VARYANTI (Önbellekteki temel tariften türetme)
+# ---------------------------------------------------------
+
+variant_stats = Counter()
+
+VARIANT_SCHEMA = (
+    "{'yemekAdi': 'Uyarlanmış yemeğin adı', "
+    "'degisimler': [{'eski': 'tarifteki malzeme satırı (aynen)', 'yeni': 'yerine geçen malzeme satırı (çıkarılacaksa boş)'}], "
+    "'eklenecek': ['yeni eklenen malzeme satırı'], "
+    "'adimlar': [{'no': 1, 'yeni': 'değişen adımın yeni hali'}]}"
+)
+
+
+def split_diet_from_name(yemek_ismi: str) -> tuple[str, str]:
+    """'Vegan Lahmacun' -> ('lahmacun', 'vegan'). Diyet ifadesi yoksa diyet boş döner."""
+    constraints = parse_diet(yemek_ismi)
+    if not constraints.bits or not constraints.rest:
+        return normalize_text(yemek_ismi), ""
+    return constraints.rest, " ".join(constraints.flags())
+
+
+async def find_base_recipe(base_name: str) -> dict | None:
+    """Diyetsiz temel tarifi önce önbellekte, sonra depoda arar; sadece tam tarifler kullanılır."""
+    base_key = make_cache_key("recipe_by_name", dish_name=base_name, diet_info="")
+    try:
+        base = await recipe_cache.get(base_key)
+    except Exception as e:
+        print(f"HATA (Temel tarif okuma): {e}")
+        base = None
+    if base is None or validate_recipe(base):
+        base = await recipe_store.get(base_key)
+    return base if base is not None and not validate_recipe(base) else None
+
+
+def apply_variant_patch(base: dict, patch: dict) -> dict | None:
+    """
+    Modelin döndüğü değişiklikleri temel tarife uygular (malzeme değişimi/çıkarma/ekleme, adım güncelleme).
+    Tarifte karşılığı bulunamayan bir değişiklik varsa None döner: yarım uygulanmış yama
+    kısıtlamaya aykırı malzemeyi tarifte bırakabilir.
+    """
+    malzemeler = list(base["malzemeler"])
+    index = {normalize_text(m): i for i, m in enumerate(malzemeler)}
+    removed = set()
+    for change in patch.get("degisimler") or []:
+        if not isinstance(change, dict):
+            continue
+        old = normalize_text(str(change.get("eski", "")))
+        i = index.get(old)
+        if i is None:
+            # Satır birebir tekrar edilmediyse içerme ile eşleştir
+            i = next((j for j, m in enumerate(malzemeler) if old and (old in normalize_text(m) or normalize_text(m) in old)), None)
+        if i is None:
+            return None
+        new = str(change.get("yeni") or "").strip()
+        if new:
+            malzemeler[i] = new
+        else:
+            removed.add(i)
+    malzemeler = [m for i, m in enumerate(malzemeler) if i not in removed]
+    malzemeler += [str(m).strip() for m in patch.get("eklenecek") or [] if str(m).strip()]
+
+    tarif = list(base["tarif"])
+    for step in patch.get("adimlar") or []:
+        if isinstance(step, dict) and isinstance(step.get("no"), int) and 1 <= step["no"] <= len(tarif) and step.get("yeni"):
+            tarif[step["no"] - 1] = str(step["yeni"])
+
+    yemek_adi = str(patch.get("yemekAdi") or base["yemekAdi"])
+    return {
+        **base,
+        "yemekAdi": yemek_adi,
+        "malzemeler": malzemeler,
+        "tarif": tarif,
+        "image_prompt": str(base["image_prompt"]).replace(base["yemekAdi"], yemek_adi),
+    }
+
+
+async def derive_diet_variant(yemek_ismi: str, diyet_notu: str) -> dict | None:
+    """
+    Diyet varyantı istenen yemeğin diyetsiz hali önbellekte/depoda varsa, tarifi baştan
+    ürettirmek yerine sadece değişiklikleri isteyip temel tarife uygular. Temel tarif yoksa
+    ya da sonuç geçersizse None döner (tam üretime düşülür).
+    """
+    base_name, name_diet = split_diet_from_name(yemek_ismi)
+    diet = " ".join(part for part in (diyet_notu, name_diet) if part)
+    if not diet:
+        return None
+    base = await find_base_recipe(base_name)
+    if base is None:
+        variant_stats["no_base"] += 1
+        return None
+
+    prompt = (
+        f"Aşağıdaki '{base['yemekAdi']}' tarifini şu kısıtlamaya uyarla: {diet_prompt(diet)}. "
+        f"Malzemeler: {json.dumps(base['malzemeler'], ensure_ascii=False)} "
+        f"Adımlar: {json.dumps(base['tarif'], ensure_ascii=False)} "
+        "Tarifi yeniden yazma; SADECE kısıtlamaya uymayan malzemelerin yerine geçenleri ve "
+        "bu yüzden değişmesi gereken adımları aşağıdaki JSON formatında döndür:"
+        + VARIANT_SCHEMA
+    )
+    response = await call_gemini(
+        prompt,
+        models=select_models("recipe_by_name", diet),
+        endpoint="recipe_variant",
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            max_output_tokens=MAX_OUTPUT_TOKENS_COMPACT,
+        )
+    )
+    patch = parse_model_json(response.text or "")
+    if patch.get("hata"):
+        raise GenerationRejected("refusal", str(patch["hata"]))
+    patched = apply_variant_patch(base, patch)
+    if patched is None:
+        variant_stats["patch_mismatch"] += 1
+        return None
+    # Boş ya da eksik yama temel tarifi olduğu gibi "varyant" diye kaydettirmesin
+    if parse_diet(diet).violations(patched["malzemeler"]):
+        variant_stats["still_violating"] += 1
+        return None
+    recipe_data = with_nutrition(patched)
+    if validate_recipe(recipe_data):
+        variant_stats["fallback"] += 1
+        return None
+    variant_stats["derived"] += 1
+    return recipe_data
+
+
+# ---------------------------------------------------------
+# SPEKÜLATİF ÖN YÜKLEME (Muhtemel sonraki isteği önceden üretme)
+# ---------------------------------------------------------
+
+class SpeculativePrefetcher:
+    """
+    Malzemeden tarif üretildikten sonra kullanıcı çoğunlukla aynı yemeğin isimden
+    tarifini ya da bir diyet varyantını açar. Upstream boştayken bunlar arka plan
+    önceliğiyle önbelleğe üretilir. İsabet oranı, ön yüklemenin kendini amorti
+    edip etmediğini gösterir (token maliyeti "prefetch" istemcisine yazılır).
+    """
+
+    def __init__(self, max_pending: int, max_tracked: int):
+        self.max_pending = max_pending
+        self.max_tracked = max_tracked
+        self._tasks: set[asyncio.Task] = set()
+        # Ön yüklenmiş ve henüz istenmemiş anahtarlar
+        self._prefetched: OrderedDict[str, float] = OrderedDict()
+        self.stats = Counter()
+
+    def schedule(self, yemek_ismi: str, diyet_notu: str):
+        if not PREFETCH_ENABLED or not yemek_ismi:
+            return
+        current = parse_diet(diyet_notu).bits
+        diets = [diyet_notu] + [
+            variant for variant in PREFETCH_DIET_VARIANTS if parse_diet(variant).bits & ~current
+        ]
+        for diet in diets:
+            cache_key = make_cache_key("recipe_by_name", dish_name=yemek_ismi, diet_info=diet)
+            if cache_key in self._prefetched:
+                continue
+            if len(self._tasks) >= self.max_pending or not upstream_scheduler.is_idle("background"):
+                self.stats["skipped_busy"] += 1
+                continue
+            task = asyncio.create_task(self._prefetch(yemek_ismi, diet, cache_key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            self.stats["scheduled"] += 1
+
+    async def _prefetch(self, yemek_ismi: str, diyet_notu: str, cache_key: str):
+        # İsteğin context'inden gelen öncelik, istemci ve süre sınırı ön yüklemeye taşınmasın
+        current_priority.set("background")
+        current_client_id.set("prefetch")
+        current_deadline.set(None)
+        try:
+            if await recipe_cache.get(cache_key) is not None or await recipe_store.existing_keys([cache_key]):
+                self.stats["skipped_cached"] += 1
+                return
+            await recipe_cache.get_or_load(cache_key, lambda: load_dish_recipe(yemek_ismi, diyet_notu, cache_key))
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"UYARI (Ön yükleme {yemek_ismi}/{diyet_notu}): {e}")
+            return
+        self.stats["completed"] += 1
+        self._prefetched[cache_key] = time.time()
+        while len(self._prefetched) > self.max_tracked:
+            self._prefetched.popitem(last=False)
+            self.stats["unused_evicted"] += 1
+
+    def record_request(self, cache_key: str):
+        """İsimden tarif isteği geldiğinde çağrılır; ön yüklenmiş bir anahtarsa isabet sayılır."""
+        if self._prefetched.pop(cache_key, None) is not None:
+            self.stats["hits"] += 1
+
+    def snapshot(self) -> dict:
+        completed = self.stats["completed"]
+        return {
+            **self.stats,
+            "enabled": PREFETCH_ENABLED,
+            "pending": len(self._tasks),
+            "hit_rate": round(self.stats["hits"] / completed, 3) if completed else None,
+        }
+
+
+prefetcher = SpeculativePrefetcher(PREFETCH_MAX_PENDING, PREFETCH_MAX_TRACKED)
+
+
+# ---------------------------------------------------------
+# API ENDPOINTLERİ
+# ---------------------------------------------------------
+
+# 1. ŞEFİN TAVSİYESİ (MENÜ)
+async def chef_menu(client_id: str | None = None):
+    # Menü, depodaki tek tek yemeklerden oluşturulur (bkz. MenuComposer)
+    try:
+        menu_data = await menu_composer.compose(client_id)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"HATA (Menu): {e}")
+        raise HTTPException(status_code=500, detail=f"Menü oluşturulamadı: {str(e)}")
+
+    return menu_data
+
+@app.post("/api/chef-recommendation")
+async def get_chef_recommendation(http_request: Request):
+    # İstemci kimliği verilmişse yakın zamanda sunulan yemekler tekrar edilmez
+    client_id = current_client_id.get()
+    client_id = None if client_id == "anonim" else client_id
+    if wants_stream(http_request):
+        return StreamingResponse(stream_chef_menu(client_id), media_type="application/x-ndjson")
+    menu_data = await run_while_connected(http_request, chef_menu(client_id))
+    return encoded_response(http_request, menu_data)
+
+def wants_stream(http_request: Request) -> bool:
+    """'Accept: application/x-ndjson' ya da ?stream=1 ile menü aşama aşama akıtılır."""
+    accept = http_request.headers.get("accept", "").lower()
+    return "application/x-ndjson" in accept or http_request.query_params.get("stream") == "1"
+
+async def stream_chef_menu(client_id: str | None):
+    """Her satır bir aşama: {"kategori": ..., "yemek": {...}}; son satır {"done": true}."""
+    try:
+        async for kategori, data in menu_composer.compose_stream(client_id):
+            yield json.dumps({"kategori": kategori, "yemek": data}, ensure_ascii=False) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"error": e.detail}, ensure_ascii=False) + "\n"
+        return
+    except Exception as e:
+        print(f"HATA (Menu akışı): {e}")
+        yield json.dumps({"error": f"Menü oluşturulamadı: {str(e)}"}, ensure_ascii=False) + "\n"
+        return
+    yield json.dumps({"done": True}) + "\n"
+
+
+# 2. TARİF ÜRETME (MALZEMEYE GÖRE) - GÜNCELLENDİ ✅
+async def recipe_from_ingredients(ingredients: list[str], kategori: str, diyet_notu: str, fields: list[str] | None = None):
+    malzeme_listesi = ", ".join(ingredients)
+    alanlar = requested_fields(fields)
+    malzeme_seti = sorted({normalize_text(i) for i in ingredients})
+    request_popularity.increment(
+        make_cache_key("popular_ingredients", ingredients=malzeme_seti, kategori=kategori, diet_info=diyet_notu),
+        {"type": "ingredients", "ingredients": malzeme_seti, "kategori": normalize_text(kategori), "diet_info": normalize_text(diyet_notu)},
+    )
+    
+    recipe_prompt = (
+        f"Sen profesyonel bir şefsin. Elimdeki malzemeler: {malzeme_listesi}. "
+        f"İstediğim kategori: {kategori}. "
+        f"⚠️ DİKKAT EDİLMESİ GEREKEN KISITLAMALAR: {diet_prompt(diyet_notu)} "
+        "Bu malzemelerle (ve varsa kısıtlamalara uyarak) yapılabilecek en iyi ve yaratıcı Türk mutfağı tarifini oluştur. "
+        "Eğer kısıtlamalar yüzünden bu malzemeler kullanılamıyorsa, uygun alternatifler önererek tarifi oluştur. "
+        + REFUSAL_INSTRUCTION +
+        "Aksi halde cevabı SADECE aşağıdaki JSON formatında döndür:"
+        + recipe_schema(generation_fields(alanlar))
+    )
+
+    cache_key = make_cache_key("recipe", ingredients=ingredients, kategori=kategori, diet_info=diyet_notu)
+
+    async def generate():
+        # Aynı malzeme/kategori için önceden üretilmiş tarif varsa depodan gelir
+        stored = await recipe_store.get(cache_key)
+        if stored is not None:
+            return stored
+        recipe_data = await generate_from_ingredients()
+        if not validate_recipe(recipe_data):
+            await recipe_store.put(
+                cache_key, normalize_text(recipe_data["yemekAdi"]), normalize_text(diyet_notu), recipe_data,
+                kategori=normalize_text(kategori),
+            )
+        return recipe_data
+
+    async def generate_from_ingredients():
+        response = await call_gemini(
+            recipe_prompt,
+            models=select_models("recipe", diyet_notu),
+            endpoint="recipe",
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                max_output_tokens=output_token_limit(alanlar),
+            )
+        )
+        return with_nutrition(await repair_recipe_fields(
+            parse_recipe_response(response), generation_fields(alanlar), select_models("recipe", diyet_notu), "recipe"
+        ))
+
+    try:
+        recipe_data = await with_negative_cache(cache_key, lambda: recipe_cache.get_or_load(
+            cache_key, generate, fields=alanlar or set(RECIPE_FIELDS), merge=merge_recipe_fields
+        ))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"HATA (Tarif): {e}")
+        raise HTTPException(status_code=500, detail=f"Tarif oluşturulamadı: {str(e)}")
+
+    # Kullanıcı muhtemelen bu yemeği isimden ya da bir diyet varyantıyla açacak
+    prefetcher.schedule(recipe_data.get("yemekAdi", ""), diyet_notu)
+    return project_recipe(recipe_data, alanlar)
+
+@app.post("/generate-recipe/")
+async def generate_recipe(request: IngredientRequest, http_request: Request):
+    if wants_async(http_request):
+        return await submit_job(http_request, "recipe", request.model_dump())
+    # Frontend'den gelen diyet bilgisi request.diet_info içinde
+    recipe_data = await run_while_connected(
+        http_request,
+        recipe_from_ingredients(request.ingredients, request.kategori, request.diet_info, request.fields),
+    )
+    return encoded_response(http_request, recipe_data)
+
+
+# 3. YEMEK İSMİNDEN TARİF - GÜNCELLENDİ ✅
+def build_dish_prompt(yemek_ismi: str, diyet_notu: str, alanlar: set[str] | None = None) -> str:
+    recipe_prompt = (
+        f"Sen profesyonel bir şefsin. Kullanıcı '{yemek_ismi}' yapmak istiyor. "
+        f"⚠️ DİKKAT EDİLMESİ GEREKEN KISITLAMALAR: {diet_prompt(diyet_notu)} "
+        "Bu yemek için (varsa kısıtlamalara uyarak) en orijinal ve lezzetli tarifi oluştur. "
+        "Örneğin kullanıcı 'Lahmacun' istediyse ama kısıtlamada 'Vegan' varsa, 'Vegan Lahmacun (Mercimekli)' tarifi ver. "
+        "Kısıtlama yoksa orijinal tarifi ver. "
+        + REFUSAL_INSTRUCTION +
+        "Aksi halde cevabı SADECE aşağıdaki JSON formatında döndür:"
+        + recipe_schema(generation_fields(alanlar), yemekAdi="Yemeğin Adı (Gerekirse Vegan/Glutensiz ibaresi ekle)")
+    )
+    return recipe_prompt
+
+async def generate_dish_recipe(yemek_ismi: str, diyet_notu: str, alanlar: set[str] | None = None):
+    """İsimden tarifi önbelleğe/depoya bakmadan doğrudan Gemini'ye ürettirir."""
+    response = await call_gemini(
+        build_dish_prompt(yemek_ismi, diyet_notu, alanlar),
+        models=select_models("recipe_by_name", diyet_notu),
+        endpoint="recipe_by_name",
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            max_output_tokens=output_token_limit(alanlar),
+        )
+    )
+    return with_nutrition(await repair_recipe_fields(
+        parse_recipe_response(response), generation_fields(alanlar), select_models("recipe_by_name", diyet_notu), "recipe_by_name"
+    ))
+
+async def load_dish_recipe(yemek_ismi: str, diyet_notu: str, cache_key: str, alanlar: set[str] | None = None):
+    """Önbellek loader'ı: önce kalıcı depoya bak (önceden üretilmiş katalog), yoksa canlı üret."""
+    stored = await recipe_store.get(cache_key)
+    if stored is not None:
+        return stored
+    # Diyet varyantıysa ve temel tarif varsa sadece değişiklikler üretilir
+    recipe_data = await derive_diet_variant(yemek_ismi, diyet_notu)
+    if recipe_data is None:
+        recipe_data = await generate_dish_recipe(yemek_ismi, diyet_notu, alanlar)
+    if not validate_recipe(recipe_data):
+        await recipe_store.put(
+            cache_key, normalize_text(yemek_ismi), normalize_text(diyet_notu), recipe_data,
+            kategori=classify_course(recipe_data),
+        )
+    return recipe_data
+
+async def recipe_from_dish_name(yemek_ismi: str, diyet_notu: str, fields: list[str] | None = None):
+    alanlar = requested_fields(fields)
+    cache_key = make_cache_key("recipe_by_name", dish_name=yemek_ismi, diet_info=diyet_notu)
+    request_popularity.increment(
+        cache_key, {"type": "dish", "dish_name": normalize_text(yemek_ismi), "diet_info": normalize_text(diyet_notu)}
+    )
+    prefetcher.record_request(cache_key)
+
+    try:
+        recipe_data = await with_negative_cache(cache_key, lambda: recipe_cache.get_or_load(
+            cache_key, lambda: load_dish_recipe(yemek_ismi, diyet_notu, cache_key, alanlar),
+            fields=alanlar or set(RECIPE_FIELDS), merge=merge_recipe_fields
+        ))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"HATA (İsimden Tarif): {e}")
+        raise HTTPException(status_code=500, detail=f"Tarif oluşturulamadı: {str(e)}")
+
+    return project_recipe(recipe_data, alanlar)
+
+@app.post("/generate-recipe-by-name/")
+async def generate_recipe_by_name(request: DishRequest, http_request: Request):
+    if wants_async(http_request):
+        return await submit_job(http_request, "recipe_by_name", request.model_dump())
+    recipe_data = await run_while_connected(
+        http_request, recipe_from_dish_name(request.dish_name, request.diet_info, request.fields)
+    )
+    return encoded_response(http_request, recipe_data)
+
+# 4. CDN UYUMLU GET VARYANTLARI
+# Aynı istek her zaman aynı URL'ye düşsün diye parametreler normalize edilir;
+# normalize olmayan URL'ler kalıcı olarak asıl (kanonik) URL'ye yönlendirilir.
+
+def cdn_cache_control(max_age: int = CDN_MAX_AGE, s_maxage: int = CDN_S_MAXAGE) -> str:
+    return (
+        f"public, max-age={max_age}, s-maxage={s_maxage}, "
+        f"stale-while-revalidate={CDN_STALE_WHILE_REVALIDATE}"
+    )
+
+def canonical_redirect(http_request: Request, params: list[tuple[str, str]]) -> RedirectResponse | None:
+    """Sorgu kanonik değilse kanonik URL'ye 301 döner, kanonikse None."""
+    canonical = urllib.parse.urlencode(sorted((k, v) for k, v in params if v))
+    if urllib.parse.unquote_plus(http_request.url.query) == urllib.parse.unquote_plus(canonical):
+        return None
+    return RedirectResponse(
+        f"{http_request.url.path}?{canonical}",
+        status_code=301,
+        headers={"Cache-Control": cdn_cache_control(s_maxage=CDN_STALE_WHILE_REVALIDATE)},
+    )
+
+def split_ingredients(values: list[str]) -> list[str]:
+    """?ingredients=a,b veya ?ingredients=a&ingredients=b biçimlerini tek listeye çevirir."""
+    items = {normalize_text(item) for value in values for item in value.split(",")}
+    return sorted(item for item in items if item)
+
+def split_fields(value: str) -> list[str]:
+    """?fields=sure,yemekAdi -> ['sure', 'yemekAdi'] (alan adları büyük/küçük harfe duyarlıdır)."""
+    return sorted({item.strip() for item in value.split(",") if item.strip()})
+
+@app.get("/api/chef-recommendation")
+async def get_chef_recommendation_cdn(http_request: Request):
+    cache_control = cdn_cache_control(
+        max_age=min(CDN_MAX_AGE, MENU_CACHE_TTL_SECONDS),
+        s_maxage=min(CDN_S_MAXAGE, MENU_CACHE_TTL_SECONDS),
+    )
+    menu_data = await run_while_connected(http_request, chef_menu())
+    return encoded_response(http_request, menu_data, cache_control)
+
+@app.get("/generate-recipe/")
+async def generate_recipe_cdn(
+    http_request: Request,
+    ingredients: list[str] = Query(...),
+    kategori: str = Query(...),
+    diet_info: str = "",
+    fields: str = "",
+):
+    malzemeler = split_ingredients(ingredients)
+    kategori = normalize_text(kategori)
+    diet_info = parse_diet(diet_info).canonical()
+    alanlar = split_fields(fields)
+    redirect = canonical_redirect(
+        http_request,
+        [
+            ("ingredients", ",".join(malzemeler)),
+            ("kategori", kategori),
+            ("diet_info", diet_info),
+            ("fields", ",".join(alanlar)),
+        ],
+    )
+    if redirect:
+        return redirect
+    recipe_data = await run_while_connected(
+        http_request, recipe_from_ingredients(malzemeler, kategori, diet_info, alanlar)
+    )
+    return encoded_response(http_request, recipe_data, cdn_cache_control())
+
+@app.get("/generate-recipe-by-name/")
+async def generate_recipe_by_name_cdn(
+    http_request: Request,
+    dish_name: str = Query(...),
+    diet_info: str = "",
+    fields: str = "",
+):
+    dish_name = normalize_text(dish_name)
+    diet_info = parse_diet(diet_info).canonical()
+    alanlar = split_fields(fields)
+    redirect = canonical_redirect(
+        http_request,
+        [("dish_name", dish_name), ("diet_info", diet_info), ("fields", ",".join(alanlar))],
+    )
+    if redirect:
+        return redirect
+    recipe_data = await run_while_connected(http_request, recipe_from_dish_name(dish_name, diet_info, alanlar))
+    return encoded_response(http_request, recipe_data, cdn_cache_control())
+
+# 5. ARKA PLAN İŞ DURUMU (long-polling)
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    job = await job_runner.wait(job_id, min(max(wait, 0), JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail="İş bulunamadı")
+    return {k: job[k] for k in ("id", "kind", "status", "result", "error", "created_at", "updated_at")}
+
+# 6. TARİF DÜZENLEME (WebSocket)
+# İstemci mesajları:
+#   {"type": "start", "dish_name": "...", "diet_info": "..."}  -> tarifin ilk hali
+#   {"type": "refine", "instruction": "daha acı olsun"}        -> sadece değişen alanlar akar
+@app.websocket("/ws/recipe-session")
+async def recipe_session(websocket: WebSocket, client_id: str = Query(...)):
+    await websocket.accept()
+    current_client_id.set(client_id)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            kind = message.get("type")
+
+            if kind == "start":
+                dish_name = message.get("dish_name", "")
+                diet_info = message.get("diet_info", "")
+                try:
+                    recipe = await recipe_from_dish_name(dish_name, diet_info)
+                except HTTPException as e:
+                    await websocket.send_json({"type": "error", "detail": e.detail})
+                    continue
+                # Anahtar sadece seçilir; her düzenleme çağrısı refine() içinde ayrıca sayılır
+                session = RefinementSession(client_pool.pick(), dish_name, diet_info, dict(recipe))
+                refinement_sessions.put(client_id, session)
+                await websocket.send_json({"type": "recipe", "recipe": session.recipe})
+
+            elif kind == "refine":
+                session = refinement_sessions.get(client_id)
+                if session is None:
+                    await websocket.send_json({"type": "error", "detail": "Oturum bulunamadı, önce 'start' gönderin."})
+                    continue
+                async with session.lock:
+                    try:
+                        async for field, value in session.refine(message.get("instruction", "")):
+                            await websocket.send_json({"type": "field", "name": field, "value": value})
+                    except Exception as e:
+                        print(f"HATA (Düzenleme): {e}")
+                        await websocket.send_json({"type": "error", "detail": f"Tarif güncellenemedi: {str(e)}"})
+                        continue
+                await websocket.send_json({"type": "recipe", "recipe": session.recipe})
+
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Bilinmeyen mesaj türü: {kind}"})
+    except WebSocketDisconnect:
+        pass
+
+def require_admin(http_request: Request):
+    """Yönetici uçları istemci bazlı kullanım verisi döndürür; token ayarlı değilse erişim yok."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Yönetici uçları kapalı (ADMIN_TOKEN ayarlanmamış)")
+    if not hmac.compare_digest(http_request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Yetkisiz")
+
+# 7. TOKEN KULLANIMI (Yönetici)
+@app.get("/api/admin/token-usage")
+async def get_token_usage(http_request: Request, day: str | None = None):
+    require_admin(http_request)
+    await token_ledger.flush()
+    day = day or token_ledger.today()
+    report = await asyncio.to_thread(token_ledger.daily_report, day)
+    clients = sorted({row["client_id"] for row in report})
+    return {
+        "since_start": {dimension: dict(values) for dimension, values in token_ledger.totals.items()},
+        "day": day,
+        "daily": report,
+        "budgets": {
+            client_id: {"spent": token_ledger.spent_today(client_id), "budget": token_ledger.budget_for(client_id)}
+            for client_id in clients
+        } if day == token_ledger.today() else {},
+    }
+
+# En sık istenen yemekler ve malzeme setleri: pregenerate.py için aday listesi
+@app.get("/api/admin/popular")
+async def get_popular(http_request: Request, limit: int = Query(default=POPULARITY_TOP_K, ge=1, le=500)):
+    require_admin(http_request)
+    hot = request_popularity.top()
+    return {
+        "dishes": [item for item in hot if item["type"] == "dish"][:limit],
+        "ingredient_sets": [item for item in hot if item["type"] == "ingredients"][:limit],
+        "sketch_resets": request_popularity.resets,
+    }
+
+# 8. İZLEME (Metrikler)
+@app.get("/api/metrics")
+async def get_metrics():
+    return {
+        "upstream_keys": client_pool.stats(),
+        "upstream_http": upstream_http.snapshot(),
+        "models": {name: stats.snapshot() for name, stats in model_stats.items()},
+        "model_fallbacks": fallback_count,
+        "cancellations": dict(cancellation_stats),
+        "scheduler": upstream_scheduler.stats(),
+        "shared_slots": shared_upstream_slots.snapshot() if shared_upstream_slots is not None else None,
+        "repairs": dict(repair_stats),
+        "negative_cache": dict(negative_stats),
+        "cache_admission": dict(cache_admission_stats),
+        "menu": dict(menu_stats),
+        "prefetch": prefetcher.snapshot(),
+        "diet_variants": dict(variant_stats),
+        "refinement_sessions": {"active": len(refinement_sessions), "evicted": refinement_sessions.evicted},
+    }
+
+# 9. BESİN DEĞERLERİ (LLM çağrısı yapılmaz)
+@app.post("/api/nutrition")
+async def compute_nutrition(request: NutritionRequest):
+    if request.porsiyon is not None and request.porsiyon < 1:
+        raise HTTPException(status_code=400, detail="porsiyon en az 1 olmalı")
+    return nutrition_engine.analyze(request.malzemeler, request.porsiyon)
+
+@app.get("/api/nutrition")
+async def get_dish_nutrition(dish_name: str, diet_info: str = ""):
+    """Önbellekte ya da tarif deposunda olan bir yemeğin besin değerleri; yoksa 404."""
+    cache_key = make_cache_key("recipe_by_name", dish_name=dish_name, diet_info=diet_info)
+    recipe_data = await recipe_cache.get(cache_key) or await recipe_store.get(cache_key)
+    if not recipe_data or not isinstance(recipe_data.get("malzemeler"), list):
+        raise HTTPException(status_code=404, detail="Bu yemeğin tarifi henüz üretilmemiş")
+    analysis = nutrition_engine.analyze(recipe_data["malzemeler"], recipe_servings(recipe_data))
+    return {"yemekAdi": recipe_data.get("yemekAdi"), **analysis}
+
+# 10. TARİF ARAMA (Depodaki tariflerde, LLM'siz)
+# Örn: /api/recipes/search?max_sure=30&max_kalori=500&diet=vegan&ingredient=domates
+@app.get("/api/recipes/search")
+async def search_recipes(
+    http_request: Request,
+    max_sure: int | None = Query(default=None, ge=0),
+    min_sure: int | None = Query(default=None, ge=0),
+    max_kalori: int | None = Query(default=None, ge=0),
+    min_kalori: int | None = Query(default=None, ge=0),
+    kategori: str = "",
+    diet: list[str] = Query(default=[]),
+    ingredient: list[str] = Query(default=[]),
+    q: str = "",
+    sort: str = Query(default="yeni", pattern="^(yeni|sure|kalori)$"),
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+):
+    # diet=vegan ya da serbest metin ("hayvansal ürün yok") aynı bayraklara çevrilir
+    constraints = parse_diet(" ".join(diet))
+    if constraints.extra:
+        raise HTTPException(status_code=400, detail=f"Tanınmayan diyet ifadesi: {constraints.extra}")
+    filters = {
+        "max_sure": max_sure, "min_sure": min_sure, "max_kalori": max_kalori, "min_kalori": min_kalori,
+        "kategori": kategori, "q": q, "diet_bits": constraints.bits, "ingredients": split_ingredients(ingredient),
+    }
+    total, items = await recipe_store.search(filters, sort, limit, offset)
+    return encoded_response(http_request, {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if offset + limit < total else None,
+        "items": items,
+    })
 
 # Dosya doğrudan çalıştırılırsa sunucuyu başlat
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Birden fazla worker için uygulama "modül:değişken" olarak verilmeli
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+Popüler yemekleri önceden üretip tarif deposuna yükleyen toplu iş.
+
+Örnek (her gece cron ile):
+    python pregenerate.py yemekler.txt --diet "" --diet vegan --diet glutensiz --concurrency 4
+
+yemekler.txt her satırda bir yemek adı içerir ('#' ile başlayan satırlar atlanır).
+İş kaldığı yerden devam eder: depoda zaten bulunan (yemek, diyet) çiftleri tekrar üretilmez.
+Sunucuyla aynı UPSTREAM_SHARED_PATH'i kullandığında, sunucunun kullanıcı isteklerine ayrılan
+kapasitesi doluyken yeni çağrı başlatmaz.
+"""
+import argparse
+import asyncio
+import time
+
+from main import (
+    current_client_id,
+    current_priority,
+    generate_dish_recipe,
+    make_cache_key,
+    normalize_text,
+    recipe_store,
+    token_ledger,
+    validate_recipe,
+)
+
+
+def read_dish_names(path: str) -> list[str]:
+    names = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                names.append(line)
+    return names
+
+
+async def pregenerate(dish_names: list[str], diets: list[str], concurrency: int, batch_size: int, force: bool):
+    # Ön ısıtma çağrıları zamanlayıcıda en düşük öncelikle sıraya girer. Bu process'in zamanlayıcısı
+    # sunucununkinden ayrıdır; sunucu worker'larıyla paylaşılan sınır UPSTREAM_SHARED_PATH üzerinden
+    # uygulanır (sunucuyla aynı dizinde/ayarla çalıştırılmalı).
+    current_priority.set("background")
+    # Token harcaması ayrı bir istemci olarak raporlanır ve kendi bütçesine tabidir (TOKEN_CLIENT_BUDGETS)
+    current_client_id.set("pregenerate")
+    jobs = {}
+    for dish_name in dish_names:
+        for diet in diets:
+            key = make_cache_key("recipe_by_name", dish_name=dish_name, diet_info=diet)
+            jobs[key] = (normalize_text(dish_name), normalize_text(diet))
+
+    done = set() if force else await recipe_store.existing_keys(list(jobs))
+    pending = [(key, *jobs[key]) for key in jobs if key not in done]
+    print(f"Toplam {len(jobs)} tarif, {len(done)} tanesi zaten depoda, {len(pending)} tanesi üretilecek.")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    batch: list[tuple[str, str, str, dict]] = []
+    stats = {"ok": 0, "invalid": 0, "failed": 0}
+    started = time.perf_counter()
+
+    async def flush():
+        if batch:
+            # Yazma sürerken diğer işçilerin eklediği satırlar kaybolmasın diye liste önce devralınır
+            rows, batch[:] = list(batch), []
+            await recipe_store.put_many(rows)
+
+    async def worker(key: str, dish_name: str, diet: str):
+        async with semaphore:
+            try:
+                recipe_data = await generate_dish_recipe(dish_name, diet)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"HATA: {dish_name} ({diet or 'kısıtlamasız'}): {e}")
+                return
+        invalid = validate_recipe(recipe_data)
+        if invalid:
+            stats["invalid"] += 1
+            print(f"GEÇERSİZ: {dish_name} ({diet or 'kısıtlamasız'}) eksik/hatalı alanlar: {', '.join(invalid)}")
+            return
+        stats["ok"] += 1
+        batch.append((key, dish_name, diet, recipe_data))
+        if len(batch) >= batch_size:
+            # Ara ara yazılır; iş yarıda kesilirse tamamlananlar kaybolmaz
+            await flush()
+        finished = stats["ok"] + stats["invalid"] + stats["failed"]
+        if finished % 10 == 0:
+            print(f"{finished}/{len(pending)} tamamlandı ({time.perf_counter() - started:.0f} sn)")
+
+    # Sunucunun lifespan'i burada çalışmaz: token kayıtları periyodik ve iş sonunda elle yazılır
+    token_ledger.start()
+    try:
+        await asyncio.gather(*(worker(*job) for job in pending))
+        await flush()
+    finally:
+        await token_ledger.stop()
+    print(
+        f"Bitti: {stats['ok']} eklendi, {stats['invalid']} geçersiz, {stats['failed']} hatalı "
+        f"({time.perf_counter() - started:.0f} sn)."
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Popüler yemekleri önceden üretip tarif deposuna yükler.")
+    parser.add_argument("dish_file", help="Her satırda bir yemek adı olan dosya")
+    parser.add_argument("--diet", action="append", dest="diets",
+                        help="Üretilecek diyet varyantı (birden fazla verilebilir, '' = kısıtlamasız)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Aynı anda en fazla kaç Gemini çağrısı yapılacağı")
+    parser.add_argument("--batch-size", type=int, default=20, help="Depoya kaç tarifte bir toplu yazılacağı")
+    parser.add_argument("--force", action="store_true", help="Depoda olanları da yeniden üret")
+    args = parser.parse_args()
+
+    diets = args.diets if args.diets is not None else [""]
+    stats = asyncio.run(
+        pregenerate(read_dish_names(args.dish_file), diets, args.concurrency, args.batch_size, args.force)
+    )
+    raise SystemExit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()